@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import argparse
+import tracemalloc
+from section_2_3_problem import MCVRPSDInstance
+from section_4_SCW_heuristic import SCW
+from section_5_look_ahead_heuristic import s_split, NN, NI
+from section_6_stochastic_2_opt import stochastic_2_opt
+
+SIZES = [10, 20, 50, 100, 200]
+CVS = [0.1, 0.3]
+CASES = ['instance', 'expected_cost', 'SCW', 'NN-split', 'NI-split', 'S2-Opt']
+COUNTED_METHODS = ['calculate_total_expected_length', 'calculate_routes_expected_cost_batch',
+                   'calculate_customers_failure_probability', 'calculate_products_success_rate']
+
+
+class EvaluationCounter:
+    def __init__(self, instance: MCVRPSDInstance):
+        """
+        统计一个实例上成本计算函数的调用次数：在实例上用计数的包装覆盖这些方法，不影响其他实例。
+        批量计算calculate_routes_expected_cost_batch记录的是计算的路线数量而不是调用次数。
+
+        :param instance: 案例
+        """
+        self.counts = {name: 0 for name in COUNTED_METHODS}
+        for name in COUNTED_METHODS:
+            setattr(instance, name, self.wrap(name, getattr(instance, name)))
+
+    def wrap(self, name, method):
+        def counted(*args, **kwargs):
+            self.counts[name] += len(args[0]) if name == 'calculate_routes_expected_cost_batch' else 1
+            return method(*args, **kwargs)
+        return counted
+
+
+def prepare_case(case, n_customers, cv, random_seed, s2opt_max_iterations):
+    """
+    准备一个基准测试：在计时之前生成实例和初始解，返回被计时的函数。
+
+    :return: (实例, 被计时的函数)
+    """
+    if case == 'instance':
+        return None, lambda: MCVRPSDInstance(n_customers=n_customers, cv=cv, random_seed=random_seed)
+    instance = MCVRPSDInstance(n_customers=n_customers, cv=cv, random_seed=random_seed)
+    if case == 'expected_cost':
+        r = NN(instance, save_pic=False)
+        return instance, lambda: instance.calculate_total_expected_length(r)
+    if case == 'SCW':
+        return instance, lambda: SCW(instance)
+    if case == 'NN-split':
+        return instance, lambda: s_split(instance, NN(instance, save_pic=False))
+    if case == 'NI-split':
+        return instance, lambda: s_split(instance, NI(instance, save_pic=False))
+    if case == 'S2-Opt':
+        R = s_split(instance, NN(instance, save_pic=False))
+        return instance, lambda: stochastic_2_opt(instance, [list(r) for r in R], result_from='NN',
+                                                  max_iterations=s2opt_max_iterations, save_pic=False, verbose=False)
+    raise ValueError('Unknown benchmark case: {}'.format(case))
+
+
+def run_case(case, n_customers, cv, random_seed=0, s2opt_max_iterations=20, measure_memory=True, repeat=3):
+    """
+    运行一个基准测试，记录运行时间（repeat次中最短的一次）、成本计算次数和内存峰值。
+    内存峰值用tracemalloc单独再运行一次测得，避免影响计时。
+
+    :return: 结果记录
+    """
+    record = {'case': case, 'n_customers': n_customers, 'cv': cv, 'random_seed': random_seed}
+    wall_times = []
+    for k in range(repeat):
+        instance, function = prepare_case(case, n_customers, cv, random_seed, s2opt_max_iterations)
+        counter = EvaluationCounter(instance) if instance is not None else None
+        start_time = time.perf_counter()
+        function()
+        wall_times.append(time.perf_counter() - start_time)
+        if k == 0:
+            record.update(counter.counts if counter is not None else {name: 0 for name in COUNTED_METHODS})
+    record['wall_time'] = min(wall_times)
+    if measure_memory:
+        instance, function = prepare_case(case, n_customers, cv, random_seed, s2opt_max_iterations)
+        tracemalloc.start()
+        function()
+        record['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return record
+
+
+def get_record_key(record):
+    return '{}|{}|{}|{}'.format(record['case'], record['n_customers'], record['cv'], record['random_seed'])
+
+
+def run_benchmarks(cases=CASES, sizes=SIZES, cvs=CVS, random_seed=0, s2opt_max_iterations=20, measure_memory=True,
+                   repeat=3):
+    """
+    对所有基准测试计时。
+
+    :return: 结果记录的字典，键见get_record_key
+    """
+    results = {}
+    for case in cases:
+        for n_customers in sizes:
+            for cv in cvs:
+                record = run_case(case, n_customers, cv, random_seed, s2opt_max_iterations, measure_memory, repeat)
+                results[get_record_key(record)] = record
+                print('{:<14}n={:<5}cv={:<5}time={:.4f}s evaluations={} batch_routes={} cdf_batches={} '
+                      'peak_memory={}'.format(case, n_customers, cv, record['wall_time'],
+                                              record['calculate_total_expected_length'],
+                                              record['calculate_routes_expected_cost_batch'],
+                                              record['calculate_products_success_rate'],
+                                              record.get('peak_memory', '-')))
+    return results
+
+
+def save_results(results, path):
+    path_dir = os.path.dirname(path)
+    if path_dir and not os.path.exists(path_dir):
+        os.makedirs(path_dir)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def compare_results(results, baseline, time_tolerance=0.2, memory_tolerance=0.2, time_floor=0.005,
+                    memory_floor=64 * 1024):
+    """
+    与保存的基准结果比较，找出变慢、成本计算次数增加或者内存峰值增加的测试。
+
+    :param results: 本次的结果
+    :param baseline: 基准结果
+    :param time_tolerance: 允许的运行时间相对增加量
+    :param memory_tolerance: 允许的内存峰值相对增加量
+    :param time_floor: 允许的运行时间绝对增加量（秒），避免很短的测试因计时抖动被误报
+    :param memory_floor: 允许的内存峰值绝对增加量（字节），避免内存很少的测试因几个对象的差别被误报
+    :return: 退步的列表，每项为(键, 指标, 基准值, 本次值)
+    """
+    regressions = []
+    for key, record in results.items():
+        if key not in baseline:
+            continue
+        base = baseline[key]
+        if record['wall_time'] > base['wall_time'] * (1 + time_tolerance) + time_floor:
+            regressions.append((key, 'wall_time', base['wall_time'], record['wall_time']))
+        for name in COUNTED_METHODS:
+            # 旧的基准结果中没有的计数不比较
+            if name in base and record.get(name, 0) > base[name]:
+                regressions.append((key, name, base[name], record[name]))
+        if 'peak_memory' in record and 'peak_memory' in base and \
+                record['peak_memory'] > base['peak_memory'] * (1 + memory_tolerance) + memory_floor:
+            regressions.append((key, 'peak_memory', base['peak_memory'], record['peak_memory']))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the MC-VRPSD heuristics.')
+    parser.add_argument('--cases', nargs='+', default=CASES, choices=CASES)
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--cv', type=float, nargs='+', default=CVS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--s2opt-max-iterations', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3, help='report the fastest of this many runs')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run')
+    parser.add_argument('--save', default=None, help='save the results as a baseline json file')
+    parser.add_argument('--compare', default=None, help='compare against a baseline json file')
+    parser.add_argument('--time-tolerance', type=float, default=0.2)
+    parser.add_argument('--time-floor', type=float, default=0.005, help='seconds')
+    parser.add_argument('--memory-tolerance', type=float, default=0.2)
+    parser.add_argument('--memory-floor', type=int, default=64 * 1024, help='bytes')
+    args = parser.parse_args()
+    benchmark_results = run_benchmarks(args.cases, args.sizes, args.cv, args.seed, args.s2opt_max_iterations,
+                                       not args.no_memory, args.repeat)
+    if args.save is not None:
+        save_results(benchmark_results, args.save)
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            benchmark_regressions = compare_results(benchmark_results, json.load(baseline_file), args.time_tolerance,
+                                                    args.memory_tolerance, args.time_floor, args.memory_floor)
+        for regression in benchmark_regressions:
+            print('REGRESSION {} {}: {} -> {}'.format(*regression))
+        if benchmark_regressions:
+            raise SystemExit(1)
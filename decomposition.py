@@ -0,0 +1,207 @@
+import math
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from section_2_3_problem import MCVRPSDInstance
+from section_6_stochastic_2_opt import stochastic_2_opt
+from section_7_computational_experiments import run_pipeline
+
+PARTITION_METHODS = ['sectors', 'kmeans']
+
+_worker_instance = None
+
+
+def _init_worker(instance):
+    global _worker_instance
+    _worker_instance = instance
+
+
+def partition_sectors(instance: MCVRPSDInstance, n_clusters):
+    """
+    按客户相对depot的极角把客户分成n_clusters个扇区，每个扇区的客户数量相同（最多相差1）。
+    扇区从相邻客户极角差最大的位置开始划分，尽量不把空间上连在一起的客户分开。
+
+    :param instance: 案例
+    :param n_clusters: 扇区的数量
+    :return: 簇的列表，每个簇为客户编号的列表，按极角排列
+    """
+    relative_position = instance.depot_customers_position[1:] - instance.depot_customers_position[0]
+    angles = np.arctan2(relative_position[:, 1], relative_position[:, 0])
+    order = np.argsort(angles, kind='stable')
+    gaps = np.diff(np.append(angles[order], angles[order[0]] + 2 * math.pi))
+    order = np.roll(order, -(int(np.argmax(gaps)) + 1))
+    return [(chunk + 1).tolist() for chunk in np.array_split(order, n_clusters) if len(chunk)]
+
+
+def partition_kmeans(instance: MCVRPSDInstance, n_clusters, random_seed=0, max_iterations=50):
+    """
+    按客户坐标做k-means聚类（Lloyd迭代），空的簇被丢弃。
+
+    :param instance: 案例
+    :param n_clusters: 簇的数量
+    :param random_seed: 初始中心的随机种子
+    :param max_iterations: 最多迭代的次数
+    :return: 簇的列表，每个簇为客户编号的列表
+    """
+    positions = np.asarray(instance.depot_customers_position[1:])
+    rng = np.random.default_rng(random_seed)
+    centers = positions[rng.choice(len(positions), size=min(n_clusters, len(positions)), replace=False)]
+    labels = None
+    for _ in range(max_iterations):
+        new_labels = ((positions[:, np.newaxis, :] - centers[np.newaxis, :, :]) ** 2).sum(axis=-1).argmin(axis=1)
+        if labels is not None and (new_labels == labels).all():
+            break
+        labels = new_labels
+        centers = np.array([positions[labels == k].mean(axis=0) if (labels == k).any() else centers[k]
+                            for k in range(len(centers))])
+    return [(np.flatnonzero(labels == k) + 1).tolist() for k in range(len(centers)) if (labels == k).any()]
+
+
+def partition_customers(instance: MCVRPSDInstance, n_clusters, method='sectors', random_seed=0):
+    if method == 'sectors':
+        return partition_sectors(instance, n_clusters)
+    if method == 'kmeans':
+        return partition_kmeans(instance, n_clusters, random_seed)
+    raise ValueError('Unknown partition method: {}'.format(method))
+
+
+def get_adjacent_clusters(instance: MCVRPSDInstance, clusters, k=5):
+    """
+    相邻的簇：某个客户的k个近邻中有另一个簇的客户。
+
+    :param instance: 案例
+    :param clusters: 簇的列表
+    :param k: 近邻的数量
+    :return: 相邻簇编号对的集合，(a, b)与(b, a)都在其中
+    """
+    customer_cluster = get_customer_cluster(instance, clusters)
+    neighbor_lists = instance.get_neighbor_lists(k)
+    adjacency = set()
+    for customer in range(1, instance.n_customers + 1):
+        for neighbor in neighbor_lists[customer]:
+            if neighbor != 0 and customer_cluster[neighbor] != customer_cluster[customer]:
+                adjacency.add((customer_cluster[customer], customer_cluster[neighbor]))
+                adjacency.add((customer_cluster[neighbor], customer_cluster[customer]))
+    return adjacency
+
+
+def get_customer_cluster(instance: MCVRPSDInstance, clusters):
+    customer_cluster = [-1] * (instance.n_customers + 1)
+    for k, customers in enumerate(clusters):
+        for customer in customers:
+            customer_cluster[customer] = k
+    return customer_cluster
+
+
+def build_sub_instance(instance: MCVRPSDInstance, customers):
+    """
+    由父实例中的一部分客户构建子实例：子实例中的客户k对应父实例中的客户customers[k - 1]。
+    坐标、需求均值和距离直接从父实例的数组中取出，车厢容量和路线长度上限与父实例相同。
+
+    :param instance: 父实例
+    :param customers: 父实例中的客户编号
+    :return: 子实例
+    """
+    nodes = np.array([0] + list(customers))
+    return MCVRPSDInstance.from_arrays(instance.depot_customers_position[nodes],
+                                       instance.customers_products_demand_mean[nodes[1:] - 1],
+                                       instance.products_capacity, instance.L, cv=instance.cv,
+                                       distance_matrix=instance.distance_matrix[np.ix_(nodes, nodes)],
+                                       name='{} - Cluster'.format(instance.name))
+
+
+def solve_cluster(instance: MCVRPSDInstance, customers, pipeline, s2opt_kwargs):
+    """
+    在一个簇的子实例上运行启发式流程，并把路线换回父实例中的客户编号。
+
+    :return: (父实例中的路线集, 运行时间)
+    """
+    start_time = time.time()
+    sub_instance = build_sub_instance(instance, customers)
+    nodes = [0] + list(customers)
+    R = run_pipeline(sub_instance, pipeline, **s2opt_kwargs)
+    return [[nodes[node] for node in r] for r in R], round(time.time() - start_time, 3)
+
+
+def _solve_cluster_in_worker(args):
+    return solve_cluster(_worker_instance, *args)
+
+
+def get_boundary_pair_filter(customer_cluster, adjacency):
+    """
+    边界修复中的路线对：两条路线分别经过两个相邻簇中的客户。同一个簇内的路线对在求解簇时已经优化过，不再尝试。
+
+    :param customer_cluster: 客户 -> 簇的编号
+    :param adjacency: 相邻簇编号对的集合
+    :return: stochastic_2_opt的pair_filter
+    """
+    route_clusters = {}
+
+    def get_route_clusters(r):
+        key = tuple(r)
+        if key not in route_clusters:
+            route_clusters[key] = {customer_cluster[node] for node in r if node != 0}
+        return route_clusters[key]
+
+    def pair_filter(r, r_apo):
+        clusters_apo = get_route_clusters(r_apo)
+        return any((a, b) in adjacency for a in get_route_clusters(r) for b in clusters_apo)
+
+    return pair_filter
+
+
+def decompose_and_solve(instance: MCVRPSDInstance, pipeline='SCW-2-opt', n_clusters=None, cluster_size=100,
+                        method='sectors', repair=True, n_workers=None, random_seed=0, verbose=False, **s2opt_kwargs):
+    """
+    先分簇后求解：把客户分成若干个扇区或空间上的簇，每个簇作为子实例并行求解，最后合并路线集，
+    并只在相邻簇的路线对之间运行S2-Opt修复边界。SCW和S2-Opt的复杂度至少是路线数量的平方，分簇后可以求解数千个客户的实例。
+
+    :param instance: 案例
+    :param pipeline: 每个簇使用的启发式流程，见section_7_computational_experiments.PIPELINES
+    :param n_clusters: 簇的数量，None时按cluster_size确定
+    :param cluster_size: 每个簇大约的客户数量
+    :param method: 分簇的方法，'sectors'或'kmeans'
+    :param repair: 是否修复边界
+    :param n_workers: 进程数，None为CPU核数，1时在当前进程中运行
+    :param random_seed: k-means的随机种子
+    :param verbose: 是否打印每个簇的求解时间
+    :param s2opt_kwargs: 传给stochastic_2_opt的其他参数，如neighbors_k、time_limit，同时用于簇内和边界修复
+    :return: 路线集
+    """
+    if n_clusters is None:
+        n_clusters = max(1, int(math.ceil(instance.n_customers / cluster_size)))
+    clusters = partition_customers(instance, n_clusters, method, random_seed)
+    tasks = [(customers, pipeline, s2opt_kwargs) for customers in clusters]
+    if n_workers == 1:
+        results = [solve_cluster(instance, *task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(instance,)) as executor:
+            results = list(executor.map(_solve_cluster_in_worker, tasks))
+    R = []
+    for k, (cluster_R, wall_time) in enumerate(results):
+        R.extend(cluster_R)
+        if verbose:
+            print('cluster {}: {} customers, {} routes, {}s'.format(k, len(clusters[k]), len(cluster_R), wall_time))
+    if repair and len(clusters) > 1:
+        pair_filter = get_boundary_pair_filter(get_customer_cluster(instance, clusters),
+                                               get_adjacent_clusters(instance, clusters))
+        R = stochastic_2_opt(instance, R, result_from='Decomposition', save_pic=False, verbose=False,
+                             pair_filter=pair_filter, **s2opt_kwargs)
+    return R
+
+
+if __name__ == '__main__':
+    mcvrpsd = MCVRPSDInstance(n_customers=400, random_seed=0)
+    for partition_method in PARTITION_METHODS:
+        t = time.time()
+        decomposition_R = decompose_and_solve(mcvrpsd, pipeline='SCW', cluster_size=100, method=partition_method,
+                                              repair=False)
+        print('{} without repair: {} ({:.2f}s)'.format(
+            partition_method, mcvrpsd.calculate_routes_total_expected_length(decomposition_R), time.time() - t))
+        t = time.time()
+        decomposition_R = decompose_and_solve(mcvrpsd, pipeline='SCW', cluster_size=100, method=partition_method,
+                                              neighbors_k=10)
+        assert sorted(node for r in decomposition_R for node in r if node != 0) == list(
+            range(1, mcvrpsd.n_customers + 1))
+        print('{} with repair: {} ({:.2f}s)'.format(
+            partition_method, mcvrpsd.calculate_routes_total_expected_length(decomposition_R), time.time() - t))
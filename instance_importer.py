@@ -0,0 +1,97 @@
+import os
+import numpy as np
+from section_2_3_problem import MCVRPSDInstance
+
+
+def parse_vrp_file(path):
+    """
+    读取CVRPLIB/TSPLIB格式的文本实例文件（如CVRPLIB中的A、B、P等算例）。
+
+    支持"KEY : VALUE"形式的设定，以及NODE_COORD_SECTION、DEMAND_SECTION和DEPOT_SECTION。
+    多车厢（MC-VRP）算例中DEMAND_SECTION的每一行为"编号 产品1需求 产品2需求 ..."，CAPACITY可以给出每个车厢的容量。
+
+    :param path: 实例文件
+    :return: (设定的字典, 编号 -> 坐标, 编号 -> 各产品需求的列表, depot编号的列表)
+    """
+    specification = {}
+    coordinates = {}
+    demands = {}
+    depots = []
+    section = None
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line == 'EOF':
+                continue
+            if line.endswith('_SECTION'):
+                section = line
+                continue
+            if ':' in line and not line[0].isdigit():
+                key, value = line.split(':', 1)
+                specification[key.strip().upper()] = value.strip()
+                section = None
+                continue
+            values = line.split()
+            if section == 'NODE_COORD_SECTION':
+                coordinates[int(values[0])] = [float(v) for v in values[1:3]]
+            elif section == 'DEMAND_SECTION':
+                demands[int(values[0])] = [float(v) for v in values[1:]]
+            elif section == 'DEPOT_SECTION':
+                depots.extend(int(v) for v in values if int(v) >= 0)
+            else:
+                raise ValueError('Unsupported line in {}: {}'.format(path, line))
+    return specification, coordinates, demands, depots
+
+
+def import_vrp_file(path, cv=0.1, L=None, max_route_length_factor=3.5):
+    """
+    把CVRPLIB/TSPLIB格式的实例文件转换为MCVRPSDInstance：文件中的需求作为需求均值，方差由cv确定。
+
+    节点按depot在前、客户按文件中编号的顺序重新编号为0..n。距离与本项目一致，为保留两位小数的欧氏距离，
+    而不是TSPLIB中EUC_2D的取整距离。单车厢算例中所有产品的需求相同，即只有一种产品。
+
+    :param path: 实例文件
+    :param cv: 方差因子
+    :param L: 路线长度上限，None时取文件中的DISTANCE，没有时取客户之间最大距离的max_route_length_factor倍
+    :param max_route_length_factor: 见L
+    :return: 实例
+    """
+    specification, coordinates, demands, depots = parse_vrp_file(path)
+    if specification.get('EDGE_WEIGHT_TYPE', 'EUC_2D') != 'EUC_2D':
+        raise ValueError('Only EUC_2D instances are supported, got {}'.format(specification['EDGE_WEIGHT_TYPE']))
+    depot = depots[0] if depots else min(coordinates)
+    customers = sorted(node for node in coordinates if node != depot)
+    positions = np.array([coordinates[depot]] + [coordinates[customer] for customer in customers])
+    demand_mean = np.array([demands[customer] for customer in customers], dtype=float)
+    capacity = [float(v) for v in specification['CAPACITY'].split()]
+    products_capacity = np.array(capacity * demand_mean.shape[1] if len(capacity) == 1 else capacity)
+    distance_matrix = MCVRPSDInstance.calculate_distance_matrix(positions)
+    if L is None:
+        L = float(specification['DISTANCE']) if 'DISTANCE' in specification else \
+            round(max_route_length_factor * float(distance_matrix[1:, 1:].max()), 2)
+    name = specification.get('NAME', os.path.splitext(os.path.basename(path))[0])
+    return MCVRPSDInstance.from_arrays(positions, demand_mean, products_capacity, L, cv=cv,
+                                       distance_matrix=distance_matrix, name='{} - CV {}'.format(name, cv))
+
+
+if __name__ == '__main__':
+    import tempfile
+    import pickle
+    from section_4_SCW_heuristic import SCW
+
+    # 保存、读取后结果不变，内存映射的实例pickle时只传递目录
+    mcvrpsd = MCVRPSDInstance(n_customers=30, random_seed=0)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        mcvrpsd.save(os.path.join(temp_dir, 'instance'))
+        loaded = MCVRPSDInstance.load(os.path.join(temp_dir, 'instance'))
+        assert SCW(loaded) == SCW(mcvrpsd)
+        assert len(pickle.dumps(loaded)) < len(pickle.dumps(mcvrpsd)) / 2
+        assert SCW(pickle.loads(pickle.dumps(loaded))) == SCW(mcvrpsd)
+
+        vrp_path = os.path.join(temp_dir, 'example.vrp')
+        with open(vrp_path, 'w') as vrp_file:
+            vrp_file.write('NAME : example\nTYPE : CVRP\nDIMENSION : 4\nEDGE_WEIGHT_TYPE : EUC_2D\nCAPACITY : 30\n'
+                           'NODE_COORD_SECTION\n1 50 50\n2 10 10\n3 90 20\n4 40 80\n'
+                           'DEMAND_SECTION\n1 0\n2 10\n3 15\n4 12\nDEPOT_SECTION\n1\n-1\nEOF\n')
+        example = import_vrp_file(vrp_path)
+        print(example.name, example.L, SCW(example))
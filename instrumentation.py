@@ -0,0 +1,192 @@
+import json
+import time
+import functools
+from contextlib import contextmanager
+
+# 实例上被计数和计时的成本计算方法
+PROFILED_METHODS = ['calculate_total_expected_length', 'calculate_routes_expected_cost_batch',
+                    'calculate_customers_failure_probability', 'calculate_products_success_rate']
+
+
+class _NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class NullProfiler:
+    """
+    什么都不记录的性能记录器，关闭记录时使用，每次调用只有一次空函数调用的开销。
+    """
+    enabled = False
+
+    def phase(self, name):
+        return _NULL_PHASE
+
+    def count(self, name, n=1):
+        pass
+
+    def trace(self, name, value):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class Profiler(NullProfiler):
+    """
+    记录一次运行中各函数、各阶段的调用次数和累计时间，计数器（如尝试和接受的改进次数），以及目标值随时间的变化。
+
+    阶段可以嵌套，嵌套关系记录为"外层;内层"形式的调用栈，除去子阶段后的时间（self time）可以导出为flame graph使用的
+    folded格式（flamegraph.pl、speedscope均可读取）。
+    """
+    enabled = True
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.calls = {}  # 阶段 -> 进入次数
+        self.times = {}  # 阶段 -> 累计时间（含子阶段）
+        self.folded = {}  # 调用栈 -> 除去子阶段后的累计时间
+        self.counts = {}  # 计数器
+        self.traces = {}  # 名称 -> [(距开始的时间, 值)]
+        self.stack = []
+        self.children_time = []
+        self.wrapped_methods = []
+
+    @contextmanager
+    def phase(self, name):
+        """
+        记录一个阶段的调用次数和时间。
+
+        :param name: 阶段的名称
+        :return: 上下文管理器
+        """
+        self.stack.append(name)
+        self.children_time.append(0)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start_time
+            key = ';'.join(self.stack)
+            self.folded[key] = self.folded.get(key, 0) + elapsed - self.children_time.pop()
+            self.stack.pop()
+            if self.children_time:
+                self.children_time[-1] += elapsed
+            self.calls[name] = self.calls.get(name, 0) + 1
+            # 递归进入的阶段只在最外层计时，避免重复累计
+            if name not in self.stack:
+                self.times[name] = self.times.get(name, 0) + elapsed
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def trace(self, name, value):
+        """
+        记录目标值，如每次改进后的总期望成本。
+
+        :param name: 轨迹的名称
+        :param value: 目标值
+        :return: 无
+        """
+        self.traces.setdefault(name, []).append((round(time.perf_counter() - self.start_time, 6), value))
+
+    def attach(self, instance):
+        """
+        在实例上用记录调用的包装覆盖成本计算方法，不影响其他实例。
+
+        :param instance: 案例
+        :return: 无
+        """
+        for name in PROFILED_METHODS:
+            setattr(instance, name, self.wrap(name, getattr(instance, name)))
+            self.wrapped_methods.append(name)
+
+    def detach(self, instance):
+        for name in self.wrapped_methods:
+            delattr(instance, name)
+        self.wrapped_methods = []
+
+    def wrap(self, name, method):
+        def profiled_method(*args, **kwargs):
+            if name == 'calculate_products_success_rate':
+                # 一次批量计算中正态分布函数的求值次数
+                self.count('norm.cdf', args[0].size)
+            with self.phase(name):
+                return method(*args, **kwargs)
+        return profiled_method
+
+    def get_rates(self):
+        """
+        每个"X.moves_evaluated"计数器对应的接受率"X.moves_accepted" / "X.moves_evaluated"。
+        """
+        return {name[:-len('.moves_evaluated')]: self.counts.get(name[:-len('evaluated')] + 'accepted', 0) / n
+                for name, n in self.counts.items() if name.endswith('.moves_evaluated') and n > 0}
+
+    def to_dict(self):
+        return {'elapsed': time.perf_counter() - self.start_time, 'calls': self.calls, 'times': self.times,
+                'counts': self.counts, 'rates': self.get_rates(), 'traces': self.traces}
+
+    def save_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def save_folded(self, path):
+        """
+        保存为folded格式的profile，每行为"调用栈 微秒数"。
+
+        :param path: 文件路径
+        :return: 无
+        """
+        with open(path, 'w') as f:
+            for stack, seconds in sorted(self.folded.items()):
+                f.write('{} {}\n'.format(stack, int(round(seconds * 1e6))))
+
+
+def get_profiler(instance):
+    """
+    实例上的性能记录器，没有打开时为NullProfiler，见MCVRPSDInstance.enable_profiler。
+    """
+    return instance.profiler if instance.profiler is not None else NULL_PROFILER
+
+
+def profiled(name):
+    """
+    把第一个参数为实例的函数作为一个阶段记录的装饰器，实例没有打开性能记录时直接调用原函数。
+
+    :param name: 阶段的名称
+    :return: 装饰器
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def profiled_function(instance, *args, **kwargs):
+            if instance.profiler is None:
+                return function(instance, *args, **kwargs)
+            with instance.profiler.phase(name):
+                return function(instance, *args, **kwargs)
+        return profiled_function
+    return decorator
+
+
+if __name__ == '__main__':
+    import os
+    from section_2_3_problem import MCVRPSDInstance
+    from section_4_SCW_heuristic import SCW
+    from section_6_stochastic_2_opt import stochastic_2_opt
+
+    mcvrpsd = MCVRPSDInstance(n_customers=50, random_seed=0)
+    profiler = mcvrpsd.enable_profiler()
+    stochastic_2_opt(mcvrpsd, SCW(mcvrpsd), save_pic=False, verbose=False)
+    for phase_name, phase_time in sorted(profiler.times.items(), key=lambda item: -item[1]):
+        print('{:<45}calls={:<10}time={:.3f}s'.format(phase_name, profiler.calls[phase_name], phase_time))
+    print(profiler.counts)
+    print(profiler.get_rates())
+    if not os.path.exists('01_Results'):
+        os.makedirs('01_Results')
+    profiler.save_json('01_Results/profile.json')
+    profiler.save_folded('01_Results/profile.folded')
@@ -0,0 +1,150 @@
+import numpy as np
+from scipy.special import ndtri
+from concurrent.futures import ProcessPoolExecutor
+from section_2_3_problem import MCVRPSDInstance
+
+
+def pack_routes(instance: MCVRPSDInstance, R):
+    """
+    把路线集打包成补齐长度的数组，便于所有路线同时模拟。
+
+    :param instance: 案例
+    :param R: 路线集
+    :return: (客户编号数组 n_routes x max_len，是否为真实客户的掩码，每个位置返回depot的往返距离)
+    """
+    routes_customers = [[node for node in r if node != 0] for r in R]
+    max_len = max([len(customers) for customers in routes_customers] + [1])
+    customers = np.zeros((len(R), max_len), dtype=int)
+    mask = np.zeros((len(R), max_len), dtype=bool)
+    for k, route_customers in enumerate(routes_customers):
+        customers[k, :len(route_customers)] = route_customers
+        mask[k, :len(route_customers)] = True
+    round_trip_length = 2 * instance.distance_matrix[customers, 0] * mask
+    return customers, mask, round_trip_length
+
+
+def simulate_routes_failure_length(instance: MCVRPSDInstance, customers, mask, round_trip_length, n_scenarios, rng,
+                                   policy='reset'):
+    """
+    对一批需求场景，重放所有路线的补货过程，得到每条路线的失败补救长度。
+
+    车辆从depot满载出发，依次服务客户；某种产品的剩余装载量不足以满足当前客户时即发生失败，车辆往返depot补货一次。
+    policy为'reset'时，补货后车辆视为满载离开该客户，这正是calculate_customers_failure_probability所依据的假设；
+    为'residual'时，补货后先补上该客户缺少的部分，剩余装载量为容量减去缺口。
+
+    :param instance: 案例
+    :param customers: 客户编号数组，见pack_routes
+    :param mask: 真实客户的掩码
+    :param round_trip_length: 每个位置往返depot的距离
+    :param n_scenarios: 场景数
+    :param rng: numpy随机数生成器
+    :param policy: 'reset'或'residual'
+    :return: n_scenarios x n_routes 的失败补救长度
+    """
+    demand_mean = instance.customers_products_demand_mean[customers - 1] * mask[:, :, np.newaxis]
+    # 需求服从正态分布，负的需求没有意义，截断为0（cv不超过0.3时概率极小）
+    demands = np.maximum(rng.normal(demand_mean, instance.cv * demand_mean,
+                                    size=(n_scenarios,) + demand_mean.shape), 0)
+    load = np.broadcast_to(instance.products_capacity, (n_scenarios, len(customers), instance.n_products)).copy()
+    failure_length = np.zeros((n_scenarios, len(customers)))
+    for k in range(customers.shape[1]):
+        load -= demands[:, :, k, :]
+        failure = (load < 0).any(axis=-1) & mask[:, k]
+        failure_length += failure * round_trip_length[:, k]
+        if policy == 'reset':
+            load[failure] = instance.products_capacity
+        elif policy == 'residual':
+            load[failure] = instance.products_capacity + np.minimum(load[failure], 0)
+        else:
+            raise ValueError('Unknown restocking policy: {}'.format(policy))
+    return failure_length
+
+
+def _simulate_shard(instance: MCVRPSDInstance, R, n_scenarios, seed_sequence, policy, batch_size):
+    """
+    模拟一部分场景，返回各路线失败补救长度的和与平方和，以及总失败补救长度的和与平方和，便于合并。
+    """
+    customers, mask, round_trip_length = pack_routes(instance, R)
+    rng = np.random.default_rng(seed_sequence)
+    routes_sum = np.zeros(len(R))
+    routes_square_sum = np.zeros(len(R))
+    total_sum = 0
+    total_square_sum = 0
+    for start in range(0, n_scenarios, batch_size):
+        failure_length = simulate_routes_failure_length(instance, customers, mask, round_trip_length,
+                                                        min(batch_size, n_scenarios - start), rng, policy)
+        total_failure_length = failure_length.sum(axis=1)
+        routes_sum += failure_length.sum(axis=0)
+        routes_square_sum += (failure_length ** 2).sum(axis=0)
+        total_sum += total_failure_length.sum()
+        total_square_sum += (total_failure_length ** 2).sum()
+    return routes_sum, routes_square_sum, total_sum, total_square_sum
+
+
+def get_confidence_interval(value_sum, square_sum, n_scenarios, confidence):
+    """
+    由样本的和与平方和求样本标准差和均值置信区间的半宽，value_sum可以是数组（如每条路线的和）。
+
+    :return: (样本标准差, 置信区间的半宽)
+    """
+    mean = value_sum / n_scenarios
+    std = np.sqrt(np.maximum(square_sum / n_scenarios - mean ** 2, 0) * n_scenarios / max(n_scenarios - 1, 1))
+    return std, ndtri(0.5 + confidence / 2) * std / np.sqrt(n_scenarios)
+
+
+def simulate_expected_cost(instance: MCVRPSDInstance, R, n_scenarios=10000, random_seed=None, policy='reset',
+                           confidence=0.95, batch_size=None, n_jobs=1):
+    """
+    用蒙特卡洛模拟估计路线集的期望成本，用于检验calculate_total_expected_length的正态近似。
+
+    :param instance: 案例
+    :param R: 路线集
+    :param n_scenarios: 场景数
+    :param random_seed: 随机种子
+    :param policy: 补货方式，见simulate_routes_failure_length
+    :param confidence: 置信区间的置信水平
+    :param batch_size: 每批同时模拟的场景数，None时按需求数组约50MB确定
+    :param n_jobs: 进程数，大于1时把场景分给多个进程模拟
+    :return: 字典，包括总期望成本的均值mean、标准差std、置信区间ci_low和ci_high，以及每条路线（与R的顺序相同，
+        没有客户的路线成本为0）的期望成本routes_mean、标准差routes_std、置信区间routes_ci_low和routes_ci_high
+    """
+    R = [r if len(r) > 2 else [] for r in R]
+    planned_length = np.array([instance.calculate_planned_length(r) for r in R], dtype=float)
+    if batch_size is None:
+        max_len = max([len(r) for r in R] + [1])
+        batch_size = max(1, int(50e6 / (8 * instance.n_products * max_len * max(len(R), 1))))
+    seed_sequences = np.random.SeedSequence(random_seed).spawn(n_jobs)
+    shards_n_scenarios = [n_scenarios // n_jobs + (1 if k < n_scenarios % n_jobs else 0) for k in range(n_jobs)]
+    if n_jobs == 1:
+        shards = [_simulate_shard(instance, R, n_scenarios, seed_sequences[0], policy, batch_size)]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            shards = list(executor.map(_simulate_shard, [instance] * n_jobs, [R] * n_jobs, shards_n_scenarios,
+                                       seed_sequences, [policy] * n_jobs, [batch_size] * n_jobs))
+    routes_sum = sum(shard[0] for shard in shards)
+    routes_square_sum = sum(shard[1] for shard in shards)
+    total_sum = sum(shard[2] for shard in shards)
+    total_square_sum = sum(shard[3] for shard in shards)
+    std, half_width = get_confidence_interval(total_sum, total_square_sum, n_scenarios, confidence)
+    mean = planned_length.sum() + total_sum / n_scenarios
+    routes_std, routes_half_width = get_confidence_interval(routes_sum, routes_square_sum, n_scenarios, confidence)
+    routes_mean = planned_length + routes_sum / n_scenarios
+    return {'mean': float(mean), 'std': float(std), 'ci_low': float(mean - half_width),
+            'ci_high': float(mean + half_width), 'n_scenarios': n_scenarios, 'routes_mean': routes_mean.tolist(),
+            'routes_std': routes_std.tolist(), 'routes_ci_low': (routes_mean - routes_half_width).tolist(),
+            'routes_ci_high': (routes_mean + routes_half_width).tolist()}
+
+
+if __name__ == '__main__':
+    import time
+    from section_4_SCW_heuristic import SCW
+    from section_5_look_ahead_heuristic import s_split, NN
+
+    for cv in [0.1, 0.3]:
+        mcvrpsd = MCVRPSDInstance(n_customers=100, cv=cv, random_seed=0)
+        for name, solution in [['SCW', SCW(mcvrpsd)], ['NN S-Split', s_split(mcvrpsd, NN(mcvrpsd, save_pic=False))]]:
+            t = time.time()
+            simulation = simulate_expected_cost(mcvrpsd, solution, n_scenarios=10000, random_seed=0)
+            print('{} cv={}: analytic {}, simulated {:.2f} [{:.2f}, {:.2f}] in {:.3f}s'.format(
+                name, cv, mcvrpsd.calculate_routes_total_expected_length(solution), simulation['mean'],
+                simulation['ci_low'], simulation['ci_high'], time.time() - t))
@@ -0,0 +1,107 @@
+import time
+import random
+from concurrent.futures import ProcessPoolExecutor
+from section_2_3_problem import MCVRPSDInstance
+from section_4_SCW_heuristic import SCW
+from section_5_look_ahead_heuristic import s_split, NN, NI
+from section_6_stochastic_2_opt import stochastic_2_opt
+
+CONSTRUCTIONS = ['SCW', 'NN', 'NI']
+
+_worker_instance = None
+
+
+def _init_worker(instance):
+    global _worker_instance
+    _worker_instance = instance
+
+
+def construct_randomized(instance: MCVRPSDInstance, construction, rng, top_k=3):
+    """
+    随机化的构造启发式。rng为None时就是原来的确定性版本。
+
+    :param instance: 案例
+    :param construction: 'SCW'、'NN'或'NI'
+    :param rng: random.Random或None
+    :param top_k: SCW每次从节约值最大的top_k个合并中随机选择
+    :return: 路线集
+    """
+    if construction == 'SCW':
+        return SCW(instance, rng=rng, top_k=top_k)
+    start_customer = rng.randint(1, instance.n_customers) if rng is not None else None
+    if construction == 'NN':
+        return s_split(instance, NN(instance, save_pic=False, start_customer=start_customer))
+    if construction == 'NI':
+        return s_split(instance, NI(instance, save_pic=False, start_customer=start_customer))
+    raise ValueError('Unknown construction heuristic: {}'.format(construction))
+
+
+def run_start(instance: MCVRPSDInstance, start_id, construction, random_seed, deterministic, top_k, improve,
+              s2opt_kwargs):
+    """
+    运行一次随机化的构造（以及S2-Opt改进）。deterministic为True时使用确定性的构造。
+
+    :return: (统计信息, 路线集)
+    """
+    start_time = time.time()
+    rng = None if deterministic else random.Random('{}-{}'.format(random_seed, start_id))
+    R = construct_randomized(instance, construction, rng, top_k)
+    construction_cost = instance.calculate_routes_total_expected_length(R)
+    if improve:
+        R = stochastic_2_opt(instance, R, result_from=construction, save_pic=False, verbose=False, **s2opt_kwargs)
+    statistics = {'start_id': start_id, 'construction': construction, 'construction_cost': construction_cost,
+                  'total_expected_cost': instance.calculate_routes_total_expected_length(R),
+                  'planned_cost': instance.calculate_routes_planned_length(R), 'n_routes': len(R),
+                  'wall_time': round(time.time() - start_time, 3)}
+    return statistics, R
+
+
+def _run_start_in_worker(args):
+    return run_start(_worker_instance, *args)
+
+
+def multi_start(instance: MCVRPSDInstance, n_starts=32, constructions=('SCW',), random_seed=0, top_k=3,
+                improve=True, n_workers=None, **s2opt_kwargs):
+    """
+    多起点构造：并行运行n_starts个随机化的构造（第i个起点使用constructions[i % len(constructions)]），
+    每个起点之后可选地用S2-Opt改进，只保留最好的解以及每个起点的统计信息。
+    实例在每个进程启动时传递一次，而不是随每个任务传递。
+
+    :param instance: 案例
+    :param n_starts: 起点的数量，前len(constructions)个起点为确定性的版本
+    :param constructions: 使用的构造启发式
+    :param random_seed: 随机种子，相同的种子得到相同的结果
+    :param top_k: SCW每次从节约值最大的top_k个合并中随机选择
+    :param improve: 是否用S2-Opt改进每个起点
+    :param n_workers: 进程数，None为CPU核数，1时在当前进程中运行
+    :param s2opt_kwargs: 传给stochastic_2_opt的其他参数，如neighbors_k、time_limit
+    :return: (最好的路线集, 每个起点的统计信息)
+    """
+    tasks = [(start_id, constructions[start_id % len(constructions)], random_seed, start_id < len(constructions),
+              top_k, improve, s2opt_kwargs) for start_id in range(n_starts)]
+    if n_workers == 1:
+        results = (run_start(instance, *task) for task in tasks)
+        return _keep_best(results)
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(instance,)) as executor:
+        return _keep_best(executor.map(_run_start_in_worker, tasks))
+
+
+def _keep_best(results):
+    best_R = None
+    best_cost = None
+    all_statistics = []
+    for statistics, R in results:
+        all_statistics.append(statistics)
+        if best_cost is None or statistics['total_expected_cost'] < best_cost:
+            best_R, best_cost = R, statistics['total_expected_cost']
+    return best_R, all_statistics
+
+
+if __name__ == '__main__':
+    mcvrpsd = MCVRPSDInstance(n_customers=50, random_seed=0)
+    start_time = time.time()
+    multi_start_R, multi_start_statistics = multi_start(mcvrpsd, n_starts=12, constructions=CONSTRUCTIONS)
+    for start_statistics in multi_start_statistics:
+        print(start_statistics)
+    print('Best Total Expected Cost: {} ({:.2f}s)'.format(
+        mcvrpsd.calculate_routes_total_expected_length(multi_start_R), time.time() - start_time))
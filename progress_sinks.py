@@ -0,0 +1,175 @@
+import json
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from section_2_3_problem import MCVRPSDInstance
+
+# 求解过程中的一个快照：路线集、图片左上角的标题、图片名称的后缀、描述中是否包含总期望成本
+Snapshot = namedtuple('Snapshot', ['R', 'title', 'save_pic_suffix', 'with_expected_cost'])
+
+
+def render_snapshot(instance: MCVRPSDInstance, snapshot: Snapshot):
+    """
+    把快照画出来并保存图片。成本在这里才计算，求解过程中只需要记录路线。
+
+    :param instance: 案例
+    :param snapshot: 快照
+    :return: 无
+    """
+    R = [list(r) for r in snapshot.R]
+    description = '{}\nPlanned Cost: {}'.format(snapshot.title, instance.calculate_routes_planned_length(R))
+    if snapshot.with_expected_cost:
+        description += '\nTotal Expected Cost: {}'.format(instance.calculate_routes_total_expected_length(R))
+    instance.draw_routes(R, description=description, show_pic=False, save_pic_suffix=snapshot.save_pic_suffix)
+
+
+class NullSink:
+    """
+    什么都不做的快照接收器。enabled为False时，求解过程连快照都不会生成。
+    """
+    enabled = False
+
+    def send(self, R, title, save_pic_suffix, with_expected_cost=True):
+        """
+        接收一个快照。
+
+        :param R: 路线集
+        :param title: 标题
+        :param save_pic_suffix: 图片名称的后缀
+        :param with_expected_cost: 描述中是否包含总期望成本
+        :return: 无
+        """
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class DrawRoutesSink(NullSink):
+    """
+    收到快照就立即画图，即原先在求解过程中直接调用draw_routes的做法。
+    """
+    enabled = True
+
+    def __init__(self, instance: MCVRPSDInstance):
+        self.instance = instance
+
+    def send(self, R, title, save_pic_suffix, with_expected_cost=True):
+        render_snapshot(self.instance, Snapshot(R, title, save_pic_suffix, with_expected_cost))
+
+
+class RecorderSink(NullSink):
+    """
+    记录快照，之后再统一画图。path为None时保存在内存中，否则逐行追加写入jsonl文件。
+    """
+    enabled = True
+
+    def __init__(self, path=None):
+        self.path = path
+        self.snapshots = []
+        self.file = open(path, 'a') if path is not None else None
+
+    def send(self, R, title, save_pic_suffix, with_expected_cost=True):
+        snapshot = Snapshot(tuple(tuple(r) for r in R), title, save_pic_suffix, with_expected_cost)
+        if self.file is None:
+            self.snapshots.append(snapshot)
+        else:
+            self.file.write(json.dumps(snapshot._asdict()) + '\n')
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    @staticmethod
+    def load(path):
+        """
+        读取写入文件的快照。
+
+        :param path: jsonl文件
+        :return: 快照列表
+        """
+        with open(path) as f:
+            return [Snapshot(**json.loads(line)) for line in f if line.strip()]
+
+    def render(self, instance: MCVRPSDInstance):
+        """
+        画出记录的所有快照。
+
+        :param instance: 案例
+        :return: 无
+        """
+        for snapshot in (self.snapshots if self.path is None else self.load(self.path)):
+            render_snapshot(instance, snapshot)
+
+
+_worker_instance = None
+
+
+def _init_renderer_worker(instance):
+    global _worker_instance
+    import matplotlib
+    matplotlib.use('Agg')
+    _worker_instance = instance
+
+
+def _render_in_worker(snapshot):
+    render_snapshot(_worker_instance, snapshot)
+
+
+class BackgroundRendererSink(NullSink):
+    """
+    在后台进程中画图，求解过程只把路线交给后台进程，不等待画图完成。实例只在启动后台进程时传递一次。
+    """
+    enabled = True
+
+    def __init__(self, instance: MCVRPSDInstance, max_pending=None):
+        """
+        :param instance: 案例
+        :param max_pending: 最多积压的快照数量，超过时丢弃新的快照，None表示不限制
+        """
+        self.max_pending = max_pending
+        self.pending = []
+        self.dropped = 0
+        self.executor = ProcessPoolExecutor(max_workers=1, initializer=_init_renderer_worker, initargs=(instance,))
+
+    def send(self, R, title, save_pic_suffix, with_expected_cost=True):
+        finished = [future for future in self.pending if future.done()]
+        self.pending = [future for future in self.pending if future not in finished]
+        for future in finished:
+            # 后台画图出错时在这里抛出，而不是随已完成的任务一起被丢弃
+            future.result()
+        if self.max_pending is not None and len(self.pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        snapshot = Snapshot(tuple(tuple(r) for r in R), title, save_pic_suffix, with_expected_cost)
+        self.pending.append(self.executor.submit(_render_in_worker, snapshot))
+
+    def close(self):
+        """
+        等待所有图片画完并关闭后台进程。
+        """
+        self.executor.shutdown(wait=True)
+        for future in self.pending:
+            future.result()
+        self.pending = []
+
+
+def get_sink(instance: MCVRPSDInstance, save_pic, sink=None):
+    """
+    求解函数使用的快照接收器：给定sink时使用sink，否则save_pic为True时立即画图，为False时什么都不做。
+
+    :param instance: 案例
+    :param save_pic: 是否保存图片
+    :param sink: 快照接收器
+    :return: 快照接收器
+    """
+    if sink is not None:
+        return sink
+    return DrawRoutesSink(instance) if save_pic else NullSink()
@@ -1,10 +1,91 @@
 import os
+import sys
 import math
+import json
 import random
+from collections import OrderedDict, namedtuple
 from functools import reduce
+import numpy as np
 import scipy.stats as stats
+from scipy.special import ndtr
 import networkx as nx
 from matplotlib import pyplot as plt
+from spatial_index import UniformGridIndex
+from instrumentation import Profiler
+
+INSTANCE_FORMAT_VERSION = 1
+# 批量计算的结果，见calculate_routes_expected_cost_batch
+RoutesCost = namedtuple('RoutesCost', ['planned_length', 'failure_probability', 'customers_mask',
+                                       'total_expected_length', 'exceeds_L'])
+# 保存的文件名 -> 实例的属性
+INSTANCE_ARRAYS = {'positions': 'depot_customers_position', 'demand_mean': 'customers_products_demand_mean',
+                   'products_capacity': 'products_capacity', 'distance_matrix': 'distance_matrix'}
+
+
+class RouteCostCache:
+    def __init__(self, max_size=100000, max_memory=None):
+        """
+        路径成本的LRU缓存。键为路径的tuple，保留方向：失败成本与行驶方向有关，因此反向路径是另一条缓存记录。
+
+        :param max_size: 最多缓存的路径数量，None表示不限制
+        :param max_memory: 缓存占用内存的上限（字节，按键和值的大小估算），None表示不限制
+        """
+        self.max_size = max_size
+        self.max_memory = max_memory
+        self.records = OrderedDict()
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def estimate_record_memory(key, value):
+        return sys.getsizeof(key) + sys.getsizeof(value)
+
+    def get(self, key):
+        """
+        查询缓存，命中时把记录移到最近使用的一端。
+
+        :param key: 路径的tuple
+        :return: 缓存的成本，未命中返回None
+        """
+        value = self.records.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.records.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """
+        写入缓存，超出数量或内存上限时淘汰最久未使用的记录。
+
+        :param key: 路径的tuple
+        :param value: 成本
+        :return: 无
+        """
+        if key in self.records:
+            self.records.move_to_end(key)
+            return
+        self.records[key] = value
+        self.memory += self.estimate_record_memory(key, value)
+        while self.records and ((self.max_size is not None and len(self.records) > self.max_size) or
+                                (self.max_memory is not None and self.memory > self.max_memory)):
+            old_key, old_value = self.records.popitem(last=False)
+            self.memory -= self.estimate_record_memory(old_key, old_value)
+            self.evictions += 1
+
+    def clear(self):
+        self.records.clear()
+        self.memory = 0
+
+    def statistics(self):
+        """
+        :return: 缓存的命中、未命中、淘汰次数以及当前的大小
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'size': len(self.records), 'memory': self.memory}
 
 
 class MCVRPSDInstance:
@@ -15,29 +96,42 @@ class MCVRPSDInstance:
         :param n_customers: 顾客数量
         :param cv: 方差因子，取0.1或0.3
         :param product_mean_distribution: 顾客单个产品的需求均值，10-30均匀分布（uniform）还是0-1分布（01）
-        :param random_seed: 随机种子，控制案例生成中均值和地理位置的随机性
+        :param random_seed: 随机种子，控制案例生成中均值和地理位置的随机性；为False时不生成数据，见from_arrays
         """
         self.n_customers = n_customers
         self.n_products = 3
 
         # 距离相关设定
         self.distributed_space = (100, 100)
-        self.depot_customers_position = []
+        self.depot_customers_position = None  # (n_customers + 1) x 2 的数组，第0行为depot
         self.depot_position = None
-        self.distances = None
+        self.distance_matrix = None  # (n_customers + 1) x (n_customers + 1) 的数组
+        self._distances = None  # distances的列表形式，第一次访问时才生成
         self.customers_depot_distance = None
         self.L = None
 
         # 容量相关的设定
         self.product_mean_distribution = product_mean_distribution
         self.cv = cv
-        self.customers_products_demand_mean = None
+        self.customers_products_demand_mean = None  # n_customers x n_products 的数组
+        self.customers_products_demand_variance = None
         self.products_capacity = None
         self.tightness_ratio = 10
 
+        # 路径期望成本的缓存，默认关闭，见enable_route_cost_cache
+        self.route_cost_cache = None
+        # k -> 近邻表，见get_neighbor_lists
+        self.neighbor_lists = {}
+        # 性能记录器，默认关闭，见enable_profiler
+        self.profiler = None
+
+        # 从save保存的目录中以内存映射方式读取时为该目录，pickle时只传递路径，见load
+        self.storage_path = None
+
         self.random_seed = random_seed
         self.name = 'Customers {} - CV {} - Random_Seed {}'.format(self.n_customers, self.cv, self.random_seed)
-        self.further_init()
+        if random_seed is not False:
+            self.further_init()
 
     @staticmethod
     def euclidean_distance(position_1, position_2):
@@ -50,28 +144,178 @@ class MCVRPSDInstance:
         :return: 无
         """
         random.seed(self.random_seed)
-        self.depot_customers_position = [(random.uniform(0, self.distributed_space[0]),
-                                          random.uniform(0, self.distributed_space[0])) for _ in
-                                         range(self.n_customers + 1)]
-        self.distances = [
-            [self.euclidean_distance(self.depot_customers_position[i], self.depot_customers_position[j])
-             for i in range(self.n_customers + 1)]
-            for j in range(self.n_customers + 1)
-        ]
-        customers_distance = [x[1:] for x in self.distances[1:]]
-        self.L = round(random.uniform(3, 4) * max([max(x) for x in customers_distance]), 2)
-
-        self.customers_products_demand_mean = []
-        for _ in range(self.n_customers):
-            products_demand = []
-            for _ in range(self.n_products):
-                mean = random.uniform(10, 30) if self.product_mean_distribution == 'uniform' else random.choice(
-                    [10, 30])
-                products_demand.append(mean)
-            self.customers_products_demand_mean.append(products_demand)
-        self.products_capacity = [sum([self.customers_products_demand_mean[i][j] for i in range(self.n_customers)]) / 10
-                                  for j in range(self.n_products)]
+        self.depot_customers_position = np.array([(random.uniform(0, self.distributed_space[0]),
+                                                   random.uniform(0, self.distributed_space[0])) for _ in
+                                                  range(self.n_customers + 1)])
+        self.distance_matrix = self.calculate_distance_matrix(self.depot_customers_position)
+        self._distances = None
+        self.L = round(random.uniform(3, 4) * float(self.distance_matrix[1:, 1:].max()), 2)
+
+        self.customers_products_demand_mean = np.array([
+            [random.uniform(10, 30) if self.product_mean_distribution == 'uniform' else random.choice([10, 30])
+             for _ in range(self.n_products)]
+            for _ in range(self.n_customers)], dtype=float)
+        # 逐个累加，与原先的sum结果完全一致
+        self.products_capacity = np.array([sum(column) / 10 for column in self.customers_products_demand_mean.T.tolist()])
         random.seed(None)
+        self.customers_products_demand_variance = (self.customers_products_demand_mean * self.cv) ** 2
+
+    @classmethod
+    def from_arrays(cls, positions, demand_mean, products_capacity, L, cv=0.1, distance_matrix=None, name=None,
+                    product_mean_distribution=None, random_seed=None):
+        """
+        由已有的数据构建实例，不经过further_init的随机生成。数组不会被复制，可以是np.load得到的内存映射数组。
+
+        :param positions: depot和客户的坐标，(n_customers + 1) x 2，第0行为depot
+        :param demand_mean: 客户各产品的需求均值，n_customers x n_products
+        :param products_capacity: 各产品（车厢）的容量
+        :param L: 路线长度上限
+        :param cv: 方差因子
+        :param distance_matrix: 距离矩阵，None时由坐标计算（保留两位小数）
+        :param name: 实例名称，None时按默认规则生成
+        :param product_mean_distribution: 需求均值的分布，仅作记录
+        :param random_seed: 生成该实例的随机种子，仅作记录
+        :return: 实例
+        """
+        demand_mean = np.asarray(demand_mean)
+        instance = cls(n_customers=len(demand_mean), cv=cv, product_mean_distribution=product_mean_distribution,
+                       random_seed=False)
+        instance.random_seed = random_seed
+        instance.n_products = demand_mean.shape[1]
+        instance.depot_customers_position = np.asarray(positions)
+        instance.distance_matrix = cls.calculate_distance_matrix(instance.depot_customers_position) \
+            if distance_matrix is None else np.asarray(distance_matrix)
+        instance.L = L
+        instance.customers_products_demand_mean = demand_mean
+        instance.customers_products_demand_variance = (demand_mean * cv) ** 2
+        instance.products_capacity = np.asarray(products_capacity)
+        instance.name = name if name is not None else \
+            'Customers {} - CV {} - Random_Seed {}'.format(instance.n_customers, cv, random_seed)
+        return instance
+
+    def save(self, path):
+        """
+        把实例保存到目录中：数组各自保存为.npy文件，其余的设定保存在meta.json中。
+        读取时可以内存映射这些数组，多个进程共用同一份数据，见load。
+
+        :param path: 目录，不存在时创建
+        :return: 无
+        """
+        if not os.path.exists(path):
+            os.makedirs(path)
+        for file_name, attribute in INSTANCE_ARRAYS.items():
+            np.save(os.path.join(path, file_name + '.npy'), np.asarray(getattr(self, attribute)))
+        meta = {'format_version': INSTANCE_FORMAT_VERSION, 'name': self.name, 'n_customers': self.n_customers,
+                'n_products': self.n_products, 'cv': self.cv, 'L': self.L,
+                'product_mean_distribution': self.product_mean_distribution, 'random_seed': self.random_seed}
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    @staticmethod
+    def load_storage_arrays(path, mmap=True):
+        return {file_name: np.load(os.path.join(path, file_name + '.npy'), mmap_mode='r' if mmap else None)
+                for file_name in INSTANCE_ARRAYS}
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        读取save保存的实例。
+
+        mmap为True时数组以只读的内存映射方式打开，只有用到的部分才会读入内存，并且操作系统在进程之间共享这些页面。
+        这样的实例在pickle时只传递目录（见__getstate__），传给进程池的工作进程几乎没有开销。
+
+        :param path: save保存的目录
+        :param mmap: 是否内存映射数组
+        :return: 实例
+        """
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('format_version') != INSTANCE_FORMAT_VERSION:
+            raise ValueError('Unsupported instance format version: {}'.format(meta.get('format_version')))
+        arrays = cls.load_storage_arrays(path, mmap)
+        instance = cls.from_arrays(arrays['positions'], arrays['demand_mean'], arrays['products_capacity'],
+                                   meta['L'], cv=meta['cv'], distance_matrix=arrays['distance_matrix'],
+                                   name=meta['name'], product_mean_distribution=meta['product_mean_distribution'],
+                                   random_seed=meta['random_seed'])
+        if mmap:
+            instance.storage_path = os.path.abspath(path)
+        return instance
+
+    @staticmethod
+    def calculate_distance_matrix(positions):
+        """
+        向量化地计算两两之间的欧氏距离，结果与逐个调用euclidean_distance完全相同。
+
+        :param positions: 点的坐标，n x 2 的数组
+        :return: n x n 的距离矩阵
+        """
+        distance_matrix = np.zeros((len(positions), len(positions)))
+        for k in range(positions.shape[1]):
+            difference = positions[np.newaxis, :, k] - positions[:, np.newaxis, k]
+            distance_matrix += difference * difference
+        np.sqrt(distance_matrix, out=distance_matrix)
+        # np.round先乘100再取整，在恰好处于两个两位小数中间附近时可能与round不同，这些位置用round重新计算
+        hundredfold = distance_matrix * 100
+        ambiguous = np.abs(hundredfold - np.floor(hundredfold) - 0.5) < 1e-6
+        del hundredfold
+        ambiguous_distances = [round(float(distance), 2) for distance in distance_matrix[ambiguous]]
+        np.round(distance_matrix, 2, out=distance_matrix)
+        distance_matrix[ambiguous] = ambiguous_distances
+        return distance_matrix
+
+    @property
+    def distances(self):
+        """
+        距离矩阵的列表形式，只为兼容按distances[i][j]逐个取值的外部代码保留，本项目中的计算都直接使用distance_matrix。
+        第一次访问时才由distance_matrix生成（大实例上会把整个矩阵转换为列表，内存映射的矩阵也会全部读入），不会随实例一起pickle。
+
+        :return: 距离矩阵，list of list
+        """
+        if self._distances is None:
+            self._distances = self.distance_matrix.tolist()
+        return self._distances
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_distances'] = None
+        if self.profiler is not None:
+            # 记录器只属于当前进程的这次运行，不随实例传递
+            for name in self.profiler.wrapped_methods:
+                del state[name]
+            state['profiler'] = None
+        if self.storage_path is not None:
+            for attribute in INSTANCE_ARRAYS.values():
+                state[attribute] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.storage_path is not None:
+            for file_name, array in self.load_storage_arrays(self.storage_path).items():
+                setattr(self, INSTANCE_ARRAYS[file_name], array)
+
+    def build_spatial_index(self, nodes=None, cell_size=None):
+        """
+        建立所有点（或指定的点）坐标上的均匀网格索引，支持删除点和k近邻、半径查询，见spatial_index.UniformGridIndex。
+        索引会随删除而改变，因此每次调用都建立一个新的索引。
+
+        :param nodes: 放入索引的点，None表示depot和所有客户
+        :param cell_size: 格子的边长
+        :return: 空间索引
+        """
+        return UniformGridIndex(self.depot_customers_position, self.distance_matrix, nodes=nodes, cell_size=cell_size)
+
+    def get_neighbor_lists(self, k):
+        """
+        每个点（包括depot）距离最近的k个点，按距离从近到远排列，距离相同时编号小的在前。
+
+        :param k: 近邻的数量
+        :return: 近邻表，第i项为点i的近邻
+        """
+        if k not in self.neighbor_lists:
+            spatial_index = self.build_spatial_index()
+            self.neighbor_lists[k] = [spatial_index.nearest(i, k) for i in range(self.n_customers + 1)]
+        return self.neighbor_lists[k]
 
     def calculate_planned_length(self, r):
         """
@@ -80,7 +324,11 @@ class MCVRPSDInstance:
         :param r: 路径
         :return: 计划路径长度
         """
-        return round(sum([self.distances[r[i]][r[i + 1]] for i in range(len(r) - 1)]), 3)
+        if len(r) < 2:
+            return 0
+        r = np.asarray(r, dtype=int)
+        # cumsum按顺序逐个相加，与sum的结果完全相同
+        return round(float(np.cumsum(self.distance_matrix[r[:-1], r[1:]])[-1]), 3)
 
     def calculate_routes_planned_length(self, R):
         """
@@ -91,8 +339,149 @@ class MCVRPSDInstance:
         """
         return round(sum([self.calculate_planned_length(r) for r in R]), 2)
 
+    def calculate_products_success_rate(self, accumulate_mean, accumulate_variance):
+        """
+        批量计算累积需求下所有产品都不发生失败的概率，一次性求出所有的正态分布函数值（ndtr即norm.cdf，但没有参数检查的开销）。
+
+        :param accumulate_mean: 各产品的累积需求均值，最后一维为产品
+        :param accumulate_variance: 各产品的累积需求方差，形状同上
+        :return: 所有产品都满足要求的概率，形状为去掉最后一维；方差为0（没有累积任何客户）时概率为1
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = (self.products_capacity - accumulate_mean) / np.sqrt(accumulate_variance)
+        success_rate = ndtr(z).prod(axis=-1)
+        return np.where(accumulate_variance.any(axis=-1), success_rate, 1)
+
     def calculate_customers_failure_probability(self, r):
         """
+        与calculate_customers_failure_probability_naive的递推相同，但用前缀和代替每个(i, j)的重复求和，
+        所有需要的累积成功率在一次向量化的norm.cdf中求出。
+
+        记S[j][i]为第j个点更新后，到第i个客户仍不失败的概率（j >= i时为1），则
+        Pr[i] = sum(Pr[j] * (S[j][i - 1] - S[j][i]) for j in range(i))。
+
+        :param r: 路径
+        :return: 每个顾客失败的概率
+        """
+        # 与原实现一致，第k个客户的需求取customers_products_demand_mean[r[k] - 1]
+        customers = np.asarray(r[1:-1], dtype=int) - 1
+        n = len(customers)
+        if n == 0:
+            return []
+        prefix_mean = np.zeros((n + 1, self.n_products))
+        prefix_mean[1:] = np.cumsum(self.customers_products_demand_mean[customers], axis=0)
+        prefix_variance = np.zeros((n + 1, self.n_products))
+        prefix_variance[1:] = np.cumsum(self.customers_products_demand_variance[customers], axis=0)
+        # S[j, i]：第j个点（0为depot）更新后，累积到第i个客户的成功率
+        S = self.calculate_products_success_rate(
+            np.maximum(prefix_mean[np.newaxis, :, :] - prefix_mean[:, np.newaxis, :], 0),
+            np.maximum(prefix_variance[np.newaxis, :, :] - prefix_variance[:, np.newaxis, :], 0))
+        S[np.tril_indices(n + 1)] = 1
+        Pr = np.zeros(n + 1)
+        Pr[0] = 1
+        for i in range(1, n + 1):
+            Pr[i] = Pr[:i] @ (S[:i, i - 1] - S[:i, i])
+        return Pr[1:].tolist()
+
+    def calculate_batch_total_expected_length(self, R):
+        """
+        一批路线各自的总期望长度。打开路径成本的缓存时先查缓存，只对未命中的路线调用calculate_routes_expected_cost_batch，
+        结果再写入缓存；SCW的合并和Solution中加入的路线都经过这里。
+
+        :param R: 路线的列表
+        :return: 每条路线的总期望长度，list
+        """
+        if self.route_cost_cache is None:
+            return self.calculate_routes_expected_cost_batch(R).total_expected_length.tolist()
+        keys = [tuple(r) for r in R]
+        costs = [self.route_cost_cache.get(key) for key in keys]
+        missing = [k for k, cost in enumerate(costs) if cost is None]
+        if missing:
+            missing_costs = self.calculate_routes_expected_cost_batch([R[k] for k in missing]).total_expected_length
+            for k, cost in zip(missing, missing_costs.tolist()):
+                costs[k] = cost
+                self.route_cost_cache.put(keys[k], cost)
+        return costs
+
+    def calculate_routes_expected_cost_batch(self, R, max_batch_memory=50e6):
+        """
+        一次计算一批路线的计划长度、每个客户的失败概率和总期望长度，结果与逐条调用calculate_planned_length、
+        calculate_customers_failure_probability和calculate_total_expected_length相同（不经过路径成本的缓存）。
+
+        路线按长度排序后分组，每组补齐成相同的长度，S矩阵、全概率递推和成本求和都在整组上向量化地进行。
+        补齐的位置需求增量为0，失败概率为0，不影响成本。
+
+        :param R: 路线的列表
+        :param max_batch_memory: 每组S矩阵占用内存的上限（字节），路线很长时每组只有一条路线
+        :return: RoutesCost，planned_length、total_expected_length和exceeds_L（总期望长度超过L）为长度len(R)的数组，
+            failure_probability为len(R) x 最多客户数的数组，customers_mask标记其中的真实客户
+        """
+        n_routes = len(R)
+        lengths = np.array([len(r) for r in R], dtype=int)
+        max_customers = max(int(lengths.max()) - 2, 0) if n_routes else 0
+        planned_length = np.zeros(n_routes)
+        failure_length = np.zeros(n_routes)
+        failure_probability = np.zeros((n_routes, max_customers))
+        customers_mask = np.arange(max_customers) < (lengths[:, np.newaxis] - 2)
+        order = np.argsort(lengths, kind='stable')
+        start = 0
+        while start < n_routes:
+            end = start + 1
+            while end < n_routes and \
+                    (end + 1 - start) * int(lengths[order[end]] - 1) ** 2 * self.n_products * 8 <= max_batch_memory:
+                end += 1
+            batch = order[start:end]
+            n_nodes = int(lengths[batch[-1]])
+            nodes = np.zeros((len(batch), n_nodes), dtype=int)
+            for k, route_k in enumerate(batch):
+                nodes[k, :lengths[route_k]] = R[route_k]
+            # 补齐的位置是depot，到depot的距离为0，按顺序累加与逐条路线的sum结果相同
+            planned_length[batch] = np.cumsum(self.distance_matrix[nodes[:, :-1], nodes[:, 1:]], axis=1)[:, -1]
+            n = n_nodes - 2
+            if n > 0:
+                mask = customers_mask[batch, :n]
+                Pr = self.calculate_batch_failure_probability(nodes[:, 1:-1], mask)
+                failure_probability[batch, :n] = Pr
+                failure_length[batch] = np.cumsum(self.distance_matrix[nodes[:, 1:-1], 0] * 2 * Pr, axis=1)[:, -1]
+            start = end
+        # 与逐条计算相同，用Python的round取整
+        planned_length = np.array([round(length, 3) for length in planned_length.tolist()])
+        total_expected_length = np.array([round(planned + failure, 2) for planned, failure in
+                                          zip(planned_length.tolist(), failure_length.tolist())])
+        return RoutesCost(planned_length, failure_probability, customers_mask, total_expected_length,
+                          total_expected_length > self.L)
+
+    def calculate_batch_failure_probability(self, customers, mask):
+        """
+        calculate_customers_failure_probability的批量版本。
+
+        :param customers: 补齐的客户编号，n_routes x n
+        :param mask: 真实客户的掩码，形状同上
+        :return: n_routes x n 的失败概率，补齐的位置为0
+        """
+        n_routes, n = customers.shape
+        # 与calculate_customers_failure_probability一致，需求取customers_products_demand_mean[r[k] - 1]
+        prefix_mean = np.zeros((n_routes, n + 1, self.n_products))
+        prefix_mean[:, 1:] = np.cumsum(self.customers_products_demand_mean[customers - 1] * mask[:, :, np.newaxis],
+                                       axis=1)
+        prefix_variance = np.zeros((n_routes, n + 1, self.n_products))
+        prefix_variance[:, 1:] = np.cumsum(
+            self.customers_products_demand_variance[customers - 1] * mask[:, :, np.newaxis], axis=1)
+        S = self.calculate_products_success_rate(
+            np.maximum(prefix_mean[:, np.newaxis, :, :] - prefix_mean[:, :, np.newaxis, :], 0),
+            np.maximum(prefix_variance[:, np.newaxis, :, :] - prefix_variance[:, :, np.newaxis, :], 0))
+        lower_rows, lower_columns = np.tril_indices(n + 1)
+        S[:, lower_rows, lower_columns] = 1
+        Pr = np.zeros((n_routes, n + 1))
+        Pr[:, 0] = 1
+        for i in range(1, n + 1):
+            Pr[:, i] = np.einsum('bj,bj->b', Pr[:, :i], S[:, :i, i - 1] - S[:, :i, i])
+        return Pr[:, 1:]
+
+    def calculate_customers_failure_probability_naive(self, r):
+        """
+        按定义逐项递推的原始实现，复杂度为O(n^3)，仅用于校验calculate_customers_failure_probability。
+
         第2个客户失败的概率等于从第0个客户到当前才失败的概率*第0个客户失败概率+从第1个客户到当前就失败的概率*第1个客户失败概率。
         第3个客户失败的概率等于从第0个客户到当前才失败的概率*第0个客户失败概率+从第1个客户到当前才失败的概率*第1个客户失败概率+
         从第2个客户到当前就失败的概率*第2个客户失败概率。
@@ -147,10 +536,67 @@ class MCVRPSDInstance:
         :param r: 路径
         :return:总期望长度
         """
+        if self.route_cost_cache is not None:
+            key = tuple(r)
+            total_expected_length = self.route_cost_cache.get(key)
+            if total_expected_length is not None:
+                return total_expected_length
         Pr = self.calculate_customers_failure_probability(r)
         # 由于Pr[0]代表第0个客户的概率，但是r[0]代表depot，因此两者的index错一位
-        return round(self.calculate_planned_length(r) + sum(
-            [self.distances[r[i + 1]][0] * 2 * Pr[i] for i in range(0, len(r) - 2)]), 2)
+        customers = np.asarray(r[1:-1], dtype=int)
+        failure_length = 0
+        if len(customers):
+            failure_lengths = self.distance_matrix[customers, 0] * 2 * np.asarray(Pr)[:len(customers)]
+            failure_length = float(np.cumsum(failure_lengths)[-1])
+        total_expected_length = round(self.calculate_planned_length(r) + failure_length, 2)
+        if self.route_cost_cache is not None:
+            self.route_cost_cache.put(key, total_expected_length)
+        return total_expected_length
+
+    def enable_route_cost_cache(self, max_size=100000, max_memory=None):
+        """
+        打开路径期望成本的缓存，反复出现的路径不再重复计算。缓存用于calculate_total_expected_length、
+        calculate_batch_total_expected_length（SCW的合并、Solution中加入的路线）；s_split按段递推的成本
+        （iterate_segments_total_expected_length，以及S2-Opt中s_split_with_costs给出的成本）不经过缓存。
+
+        :param max_size: 最多缓存的路径数量
+        :param max_memory: 缓存占用内存的上限（字节）
+        :return: 缓存对象
+        """
+        self.route_cost_cache = RouteCostCache(max_size=max_size, max_memory=max_memory)
+        return self.route_cost_cache
+
+    def disable_route_cost_cache(self):
+        self.route_cost_cache = None
+
+    def enable_profiler(self):
+        """
+        打开性能记录：成本计算的调用次数和时间、SCW和stochastic_2_opt等各阶段的时间、改进次数以及目标值的轨迹，
+        见instrumentation.Profiler。关闭时各处只多一次判断。
+
+        :return: 性能记录器
+        """
+        self.disable_profiler()
+        self.profiler = Profiler()
+        self.profiler.attach(self)
+        return self.profiler
+
+    def disable_profiler(self):
+        if self.profiler is not None:
+            self.profiler.detach(self)
+        self.profiler = None
+
+    @property
+    def cache_hits(self):
+        return self.route_cost_cache.hits if self.route_cost_cache is not None else 0
+
+    @property
+    def cache_misses(self):
+        return self.route_cost_cache.misses if self.route_cost_cache is not None else 0
+
+    @property
+    def cache_evictions(self):
+        return self.route_cost_cache.evictions if self.route_cost_cache is not None else 0
 
     def calculate_routes_total_expected_length(self, R):
         """
@@ -182,7 +628,7 @@ class MCVRPSDInstance:
                 g.nodes[node]['demand'] = self.customers_products_demand_mean[node - 1]
         for r in R:
             for i in range(len(r) - 1):
-                g.add_edge(r[i], r[i + 1], weight=self.distances[r[i]][r[i + 1]])
+                g.add_edge(r[i], r[i + 1], weight=float(self.distance_matrix[r[i], r[i + 1]]))
         pos = {i: self.depot_customers_position[i] for i in g.nodes}
         plt.figure(figsize=[7, 7])
         nx.draw(g, pos, with_labels=True, font_color='w')
@@ -222,3 +668,30 @@ if __name__ == '__main__':
                            (instance.customers_products_demand_mean[2][2] * instance.cv))
     # 第一个顾客不满足要求的概率是
     pr_1 = 1 - c1_p0 * c1_p2 * c1_p1
+
+    # 检验新的计算引擎与按定义递推的结果一致
+    for seed in range(5):
+        for cv in [0.1, 0.3]:
+            check_instance = MCVRPSDInstance(n_customers=30, cv=cv, random_seed=seed)
+            check_random = random.Random(seed)
+            for _ in range(10):
+                check_r = [0] + check_random.sample(range(1, check_instance.n_customers + 1),
+                                                    check_random.randint(1, 15)) + [0]
+                Pr_fast = check_instance.calculate_customers_failure_probability(check_r)
+                Pr_naive = check_instance.calculate_customers_failure_probability_naive(check_r)
+                assert max(abs(x - y) for x, y in zip(Pr_fast, Pr_naive)) < 1e-9
+                assert check_instance.calculate_total_expected_length(check_r) == round(
+                    check_instance.calculate_planned_length(check_r) + sum(
+                        [check_instance.distance_matrix[check_r[i + 1], 0] * 2 * Pr_naive[i]
+                         for i in range(len(check_r) - 2)]), 2)
+    print('failure probability engine matches the naive recursion')
+
+    # 检验批量计算与逐条计算的结果一致
+    check_instance = MCVRPSDInstance(n_customers=30, cv=0.3, random_seed=0)
+    check_random = random.Random(0)
+    check_R = [[0] + check_random.sample(range(1, 31), check_random.randint(0, 15)) + [0] for _ in range(50)]
+    check_cost = check_instance.calculate_routes_expected_cost_batch(check_R)
+    for check_k, check_r in enumerate(check_R):
+        assert check_cost.total_expected_length[check_k] == check_instance.calculate_total_expected_length(check_r)
+        assert check_cost.planned_length[check_k] == check_instance.calculate_planned_length(check_r)
+    print('batch evaluation matches the single-route engine')
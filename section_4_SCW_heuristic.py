@@ -1,68 +1,172 @@
+import heapq
 from section_2_3_problem import MCVRPSDInstance
+from progress_sinks import get_sink
+from solution import Solution
+from instrumentation import get_profiler, profiled
 
 
-def SCW(instance: MCVRPSDInstance, save_pic=False):
+def get_merging_combinations(r, r_apo):
+    """
+    两条路线首尾相接的四种方式，每种方式包含两个方向。
+
+    :param r: 路线
+    :param r_apo: 另一条路线
+    :return: 四种合并方式，每种为[方向一, 方向二]
+    """
+    u_e = r[1:]  # e: end
+    e_u = list(reversed(u_e))
+    s_v = r[:-1]  # s: start
+    v_s = list(reversed(s_v))
+    u_e_apo = r_apo[1:]
+    e_u_apo = list(reversed(u_e_apo))
+    s_v_apo = r_apo[:-1]
+    v_s_apo = list(reversed(s_v_apo))
+    return [[e_u + u_e_apo, e_u_apo + u_e],
+            [e_u + v_s_apo, s_v_apo + u_e],
+            [s_v + u_e_apo, e_u_apo + v_s],
+            [s_v + v_s_apo, s_v_apo + v_s]]
+
+
+def push_savings(instance: MCVRPSDInstance, savings_heap, solution: Solution, route_pairs):
+    """
+    计算若干对路线之间（两个方向）所有可行合并的节约值并放入堆中。
+    所有合并后的路线在一次calculate_batch_total_expected_length中批量计算（打开缓存时先查缓存），SCW每一轮只调用一次。
+
+    堆中的元素为(-节约值, 路线编号, 另一路线编号, 合并方式, 方向, 合并后路线的期望成本)，合并后的路线不放入堆中，
+    取出时再由两条路线的首尾拼接，见get_merged_route。
+    路线编号按生成顺序递增，与路线在R中的先后顺序一致，因此堆顶就是原先按(r, r_apo, 合并方式)顺序遍历时第一个取得最大节约值的合并。
+
+    :param instance: 案例
+    :param savings_heap: 节约值堆
+    :param solution: 当前的路线集
+    :param route_pairs: (路线编号, 另一路线编号)的列表
+    :return: 无
+    """
+    candidates = []  # (r_1_id, r_2_id, 合并方式, 原成本, 两个方向)
+    combination_index = {}  # 合并后的路线 -> 在批量计算中的位置
+    for route_id, route_apo_id in route_pairs:
+        r, r_expected_cost, r_planned_cost = (solution.get_route(route_id), solution.expected_cost[route_id],
+                                              solution.planned_cost[route_id])
+        r_apo, r_apo_expected_cost, r_apo_planned_cost = (solution.get_route(route_apo_id),
+                                                          solution.expected_cost[route_apo_id],
+                                                          solution.planned_cost[route_apo_id])
+        combination_pairs = get_merging_combinations(r, r_apo)
+        # (r_apo, r)的四种合并方式与(r, r_apo)的是同一批路线，只是方向对调，且第2、3种互换
+        combination_pairs_apo = [combination_pairs[k][::-1] for k in [0, 2, 1, 3]]
+        for r_1_expected_cost, r_2_planned_cost, r_1_id, r_2_id, pairs in [
+            [r_expected_cost, r_apo_planned_cost, route_id, route_apo_id, combination_pairs],
+            [r_apo_expected_cost, r_planned_cost, route_apo_id, route_id, combination_pairs_apo]
+        ]:
+            original_cost = r_1_expected_cost + r_2_planned_cost
+            for k, combination_pair in enumerate(pairs):
+                for combination in combination_pair:
+                    combination_index.setdefault(tuple(combination), len(combination_index))
+                candidates.append((r_1_id, r_2_id, k, original_cost, combination_pair))
+    if not candidates:
+        return
+    combination_costs = instance.calculate_batch_total_expected_length(list(combination_index))
+    for r_1_id, r_2_id, k, original_cost, combination_pair in candidates:
+        combination_pairs_total_cost = [combination_costs[combination_index[tuple(combination)]]
+                                        for combination in combination_pair]
+        min_merging_cost = min(combination_pairs_total_cost)
+        if min_merging_cost < instance.L:
+            heapq.heappush(savings_heap, (min_merging_cost - original_cost, r_1_id, r_2_id, k,
+                                          combination_pairs_total_cost.index(min_merging_cost), min_merging_cost))
+
+
+def get_merged_route(solution: Solution, r_1_id, r_2_id, k, direction):
+    """
+    节约值堆中一条记录对应的合并后的路线：按合并方式取两条路线的首尾拼接。
+
+    :param solution: 当前的路线集
+    :param r_1_id: 路线编号
+    :param r_2_id: 另一路线编号
+    :param k: 合并方式，见get_merging_combinations
+    :param direction: 方向
+    :return: 合并后的路线
+    """
+    return get_merging_combinations(solution.get_route(r_1_id), solution.get_route(r_2_id))[k][direction]
+
+
+def pop_random_saving(savings_heap, solution: Solution, rng, top_k):
+    """
+    从节约值最大的top_k个有效合并（节约值不小于0）中随机取出一个，节约值与最大值相同的合并总在候选中，其余的放回堆中。
+
+    :param savings_heap: 节约值堆，堆顶为有效的合并
+    :param solution: 当前的路线集
+    :param rng: random.Random
+    :param top_k: 候选的数量
+    :return: 取出的合并
+    """
+    candidates = []
+    while savings_heap and savings_heap[0][0] <= 0 and (len(candidates) < top_k or
+                                                        savings_heap[0][0] == candidates[0][0]):
+        saving = heapq.heappop(savings_heap)
+        if saving[1] in solution and saving[2] in solution:
+            candidates.append(saving)
+    chosen = candidates.pop(rng.randrange(len(candidates)))
+    for saving in candidates:
+        heapq.heappush(savings_heap, saving)
+    return chosen
+
+
+@profiled('SCW')
+def SCW(instance: MCVRPSDInstance, save_pic=False, sink=None, rng=None, top_k=1):
     """
     Similarly to the classical savings algorithm, the SCW heuristic starts from a trivial
     solution comprised of n round trips from the depot to each customer. Then it tries at each iteration to
     merge two routes by their extreme vertices (those connected to the depot), aiming to generate the largest
     possible savings in the overall cost.
 
+    节约值保存在堆中：合并之后只删除（惰性地跳过）涉及被合并两条路线的记录，并只计算新路线与其余路线之间的节约值。
+    路线集保存在Solution中，合并只更新被合并的两条路线和新路线，新路线的期望成本直接取自堆中的记录。
+    给定rng时为随机化的版本：每次从节约值最大的top_k个合并中随机选择一个（top_k为1时只打破节约值相同的平局）。
+
     :param instance: 案例
     :param save_pic: 是否保存图片
+    :param sink: 接收求解过程快照的对象，见progress_sinks，给定时忽略save_pic
+    :param rng: random.Random，None表示确定性的版本
+    :param top_k: 随机化版本中候选合并的数量
     :return: 规划的路线的集合
     """
     R = []
     for customer in range(1, instance.n_customers + 1):
         R.append([0, customer, 0])
+    sink = get_sink(instance, save_pic, sink)
     R_version = 0
-    instance.draw_routes(R, description='Planned Cost: {}\nTotal Expected Cost: {}'.format(
-        instance.calculate_routes_planned_length(R), instance.calculate_routes_total_expected_length(R)),
-                         show_pic=False, save_pic_suffix='SCW {}'.format(R_version))
+    if sink.enabled:
+        sink.send(R, 'SCW {}'.format(R_version), 'SCW {}'.format(R_version))
     R_version += 1
+    profiler = get_profiler(instance)
+    with profiler.phase('initial savings'):
+        solution = Solution(instance, R)
+        savings_heap = []
+        push_savings(instance, savings_heap, solution, [(route_id, route_apo_id) for route_id in range(len(R))
+                                                        for route_apo_id in range(route_id + 1, len(R))])
+    profiler.trace('SCW', solution.total_expected_length)
+    profiler.trace('SCW.planned', solution.total_planned_length)
     while True:
-        saving_list = []
-        route_records = []
-        combination_list = []
-        for r in R:
-            u_e = r[1:]  # e: end
-            e_u = list(reversed(u_e))
-            s_v = r[:-1]  # s: start
-            v_s = list(reversed(s_v))
-            for r_apo in R:
-                if r == r_apo:
-                    continue
-                u_e_apo = r_apo[1:]
-                e_u_apo = list(reversed(u_e_apo))
-                s_v_apo = r_apo[:-1]
-                v_s_apo = list(reversed(s_v_apo))
-                all_possible_combination_pairs = [[e_u + u_e_apo, e_u_apo + u_e],
-                                                  [e_u + v_s_apo, s_v_apo + u_e],
-                                                  [s_v + u_e_apo, e_u_apo + v_s],
-                                                  [s_v + v_s_apo, s_v_apo + v_s]]
-                original_cost = instance.calculate_total_expected_length(
-                    r) + instance.calculate_planned_length(r_apo)
-                for combination_pair in all_possible_combination_pairs:
-                    combination_pairs_total_cost = [
-                        instance.calculate_total_expected_length(combination_pair[0]),
-                        instance.calculate_total_expected_length(combination_pair[1])]
-                    min_merging_cost = min(combination_pairs_total_cost)
-                    if min_merging_cost < instance.L:
-                        saving_list.append(original_cost - min_merging_cost)
-                        route_records.append([r, r_apo])
-                        combination_list.append(combination_pair[combination_pairs_total_cost.index(min_merging_cost)])
-        s_max = max(saving_list)
-        if s_max < 0 or len(saving_list) == 0:
-            return R
+        while savings_heap and (savings_heap[0][1] not in solution or savings_heap[0][2] not in solution):
+            heapq.heappop(savings_heap)
+        if not savings_heap or savings_heap[0][0] > 0:
+            return solution.get_routes()
+        if rng is None:
+            _, route_id, route_apo_id, k, direction, merged_cost = heapq.heappop(savings_heap)
         else:
-            best_merge_index = saving_list.index(s_max)
-            R.remove(route_records[best_merge_index][0])
-            R.remove(route_records[best_merge_index][1])
-            R.append(combination_list[best_merge_index])
-            if save_pic:
-                instance.draw_routes(R, description='SCW {}\nPlanned Cost: {}\nTotal Expected Cost: {}'.format(R_version,                     instance.calculate_routes_planned_length(R), instance.calculate_routes_total_expected_length(R)),
-                                     show_pic=False, save_pic_suffix='SCW {}'.format(R_version))
-            R_version += 1
+            _, route_id, route_apo_id, k, direction, merged_cost = pop_random_saving(savings_heap, solution, rng,
+                                                                                      top_k)
+        with profiler.phase('merge'):
+            merged_route = get_merged_route(solution, route_id, route_apo_id, k, direction)
+            merged_route_id = solution.replace_routes([route_id, route_apo_id], [merged_route], [merged_cost])[0]
+            push_savings(instance, savings_heap, solution, [(other_route_id, merged_route_id)
+                                                            for other_route_id in solution
+                                                            if other_route_id != merged_route_id])
+        profiler.count('SCW.merges')
+        profiler.trace('SCW', solution.total_expected_length)
+        profiler.trace('SCW.planned', solution.total_planned_length)
+        if sink.enabled:
+            sink.send(solution.get_routes(), 'SCW {}'.format(R_version), 'SCW {}'.format(R_version))
+        R_version += 1
 
 
 if __name__ == '__main__':
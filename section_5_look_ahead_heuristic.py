@@ -1,4 +1,51 @@
+import heapq
+import numpy as np
 from section_2_3_problem import MCVRPSDInstance
+from progress_sinks import get_sink
+from instrumentation import profiled
+
+
+def iterate_segments_total_expected_length(instance: MCVRPSDInstance, r: list, i: int):
+    """
+    依次给出路径[0] + r[i + 1: j + 1] + [0]（j = i + 1, ..., len(r) - 1）的总期望长度，与calculate_total_expected_length的结果相同。
+
+    j每前进一步，只把新客户的需求加到累积均值和方差上，并在calculate_customers_failure_probability的递推中追加一项，
+    前面客户的失败概率保持不变，因此不需要构造中间路径，也不需要对每一段重新递推。
+    各段的成本是递推的中间结果，不经过路径成本的缓存（见MCVRPSDInstance.enable_route_cost_cache）。
+
+    :param instance: 案例
+    :param r: 以depot开始并结束的路径
+    :param i: 上一次结束的位置，不包括在路径中
+    :return: 生成器
+    """
+    n_customers = len(r) - 2 - i  # 最后一位是depot
+    # 各段依次加入的边（上一个点 -> 客户）和客户回到depot的边，一次从距离矩阵中取出
+    nodes = np.array(r[i:len(r) - 1], dtype=int)
+    nodes[0] = 0
+    edge_lengths = instance.distance_matrix[nodes[:-1], nodes[1:]].tolist()
+    return_lengths = instance.distance_matrix[nodes[1:], 0].tolist()
+    prefix_mean = np.zeros((n_customers + 1, instance.n_products))
+    prefix_variance = np.zeros((n_customers + 1, instance.n_products))
+    Pr = np.zeros(n_customers + 1)
+    Pr[0] = 1
+    previous_success_rate = np.ones(1)  # 第t个点更新后到上一个客户仍不失败的概率，t = 0, ..., k - 1
+    planned_length = 0  # 不含回到depot的边
+    failure_length = 0
+    total_expected_length = 0
+    for k in range(1, n_customers + 1):
+        customer = r[i + k]
+        prefix_mean[k] = prefix_mean[k - 1] + instance.customers_products_demand_mean[customer - 1]
+        prefix_variance[k] = prefix_variance[k - 1] + instance.customers_products_demand_variance[customer - 1]
+        success_rate = instance.calculate_products_success_rate(prefix_mean[k] - prefix_mean[:k],
+                                                                prefix_variance[k] - prefix_variance[:k])
+        Pr[k] = Pr[:k] @ (previous_success_rate - success_rate)
+        previous_success_rate = np.append(success_rate, 1)
+        planned_length += edge_lengths[k - 1]
+        failure_length += return_lengths[k - 1] * 2 * Pr[k]
+        total_expected_length = round(round(planned_length + return_lengths[k - 1], 3) + failure_length, 2)
+        yield total_expected_length
+    # j指向最后一位depot时，路径末尾多出的depot不增加任何成本
+    yield total_expected_length
 
 
 def s_split(instance: MCVRPSDInstance, r: list):
@@ -9,87 +56,166 @@ def s_split(instance: MCVRPSDInstance, r: list):
     :param r: 路径
     :return:
     """
+    return s_split_with_costs(instance, r)[0]
+
+
+@profiled('s_split')
+def s_split_with_costs(instance: MCVRPSDInstance, r: list):
+    """
+    与s_split相同，同时给出切分得到的每条路线的总期望长度（即动态规划中已经算出的各段成本），不需要再逐条计算。
+    无法切分成都不超过L的路线时（如某个客户的往返就超过L），没有经过动态规划的路线用calculate_total_expected_length计算成本。
+
+    :param instance: 案例
+    :param r: 路径
+    :return: (路线集, 每条路线的总期望长度)
+    """
     Q = 1e10
     Z = [Q for _ in range(len(r))]
     Z[0] = 0
     B = [0 for _ in range(len(r))]
+    C = [None for _ in range(len(r))]  # 以j结尾的最后一段的成本，None表示动态规划没有到达j
     for i in range(len(r) - 1):
-        for j in range(i + 1, len(r)):
-            # i所指向的位置是上一次结束的位置，路径中不应包括进去，应补0；j+1则代表末尾点是包含在路径里面的
-            if j == len(r):
-                current_r = [0] + r[i + 1: j + 1]  # 当j指向最后一位时，由于最后一位一定是0因此路径不再补充0
-            else:
-                current_r = [0] + r[i + 1: j + 1] + [0]
-            current_total_expected_cost = instance.calculate_total_expected_length(current_r)
+        # i所指向的位置是上一次结束的位置，路径中不应包括进去；j则代表末尾点是包含在路径里面的
+        for j, current_total_expected_cost in enumerate(iterate_segments_total_expected_length(instance, r, i),
+                                                        start=i + 1):
             if current_total_expected_cost <= instance.L:
                 if Z[j] > Z[i] + current_total_expected_cost:
                     Z[j] = Z[i] + current_total_expected_cost
                     B[j] = i
+                    C[j] = current_total_expected_cost
             else:
                 break
     i = len(r) - 1
     R = [[0] + r[B[i] + 1:]]
+    costs = [C[i]]
     i = B[i]
     while i != 0:
         R.append([0] + r[B[i] + 1:i + 1] + [0])
+        costs.append(C[i])
         i = B[i]
-    return R
+    costs = [instance.calculate_total_expected_length(route) if cost is None else cost
+             for route, cost in zip(R, costs)]
+    return R, costs
 
 
-def NN(instance: MCVRPSDInstance, save_pic=True):
+@profiled('NN')
+def NN(instance: MCVRPSDInstance, save_pic=True, sink=None, start_customer=None):
+    """
+    最近邻法构造巨型路线。未访问的客户放在空间索引中，每一步查询上一个点的最近邻并将其删除；距离相同时取编号小的客户。
+
+    :param instance: 案例
+    :param save_pic: 是否保存图片
+    :param sink: 接收求解过程快照的对象，见progress_sinks，给定时忽略save_pic
+    :param start_customer: 第一个访问的客户，None表示depot的最近邻
+    :return: 巨型路线
+    """
+    sink = get_sink(instance, save_pic, sink)
     r = [0]
-    rest_customers = list(range(1, instance.n_customers + 1))
+    rest_customers = instance.build_spatial_index(nodes=range(1, instance.n_customers + 1))
+    if start_customer is not None:
+        r.append(start_customer)
+        rest_customers.remove(start_customer)
     while rest_customers:
-        large_number = 1e10
-        n = -1
-        last_customer = r[-1]
-        for customer in rest_customers:
-            if customer not in r and customer != last_customer:
-                if instance.distances[customer][last_customer] < large_number:
-                    n = customer
-                    large_number = instance.distances[customer][last_customer]
+        n = rest_customers.nearest(r[-1])[0]
         r.append(n)
         rest_customers.remove(n)
-        if save_pic:
-            instance.draw_routes([r], description='NN Algorithm {}\nPlanned Cost: {}'.format(
-                len(r), instance.calculate_planned_length(r)),
-                                 show_pic=False, save_pic_suffix='NN Algorithm {}'.format(len(r)))
+        if sink.enabled:
+            sink.send([r], 'NN Algorithm {}'.format(len(r)), 'NN Algorithm {}'.format(len(r)),
+                      with_expected_cost=False)
     r.append(0)
-    if save_pic:
-        instance.draw_routes([r], description='NN Algorithm {}\nPlanned Cost: {}'.format(
-            len(r), instance.calculate_planned_length(r)),
-                             show_pic=False, save_pic_suffix='NN Algorithm {}'.format(len(r)))
+    if sink.enabled:
+        sink.send([r], 'NN Algorithm {}'.format(len(r)), 'NN Algorithm {}'.format(len(r)),
+                  with_expected_cost=False)
     return r
 
 
-def NI(instance: MCVRPSDInstance, save_pic=True):
-    farthest_customer = instance.distances[0].index(max(instance.distances[0]))
+def get_insertion_deltas(distance_matrix, customers, a, b):
+    """
+    把各个客户插入边(a, b)后计划长度的增加量，以0.01为单位取整。距离都保留两位小数，因此按整数比较与比较取整后的计划长度完全等价。
+
+    :param distance_matrix: 距离矩阵
+    :param customers: 客户的列表
+    :param a: 边的起点
+    :param b: 边的终点
+    :return: 每个客户的增加量（整数）的列表
+    """
+    customers = np.asarray(customers, dtype=int)
+    return np.round((distance_matrix[a, customers] + distance_matrix[customers, b] - distance_matrix[a, b]) * 100
+                    ).astype(int).tolist()
+
+
+@profiled('NI')
+def NI(instance: MCVRPSDInstance, save_pic=True, sink=None, start_customer=None):
+    """
+    最近插入法（cheapest insertion）构造巨型路线。
+
+    每个未插入的客户缓存其最优插入的增加量和插入的边（以边的起点表示），并放入堆中。插入一个客户后，边(a, b)被(a, c)和(c, b)替代：
+    最优插入边正是(a, b)的客户重新扫描整条路线，其余客户只需与两条新边比较。增加量相同时，与原先逐个尝试的做法一样，
+    取路线中靠前的边、编号小的客户，因此得到的路线与原先的完全相同。
+
+    :param instance: 案例
+    :param save_pic: 是否保存图片
+    :param sink: 接收求解过程快照的对象，见progress_sinks，给定时忽略save_pic
+    :param start_customer: 初始路线中的客户，None表示距离depot最远的客户
+    :return: 巨型路线
+    """
+    sink = get_sink(instance, save_pic, sink)
+    farthest_customer = int(np.argmax(instance.distance_matrix[0])) if start_customer is None else start_customer
     r = [0, farthest_customer, 0]
-    if save_pic:
-        instance.draw_routes([r], description='NI Algorithm {}\nPlanned Cost: {}'.format(
-            len(r), instance.calculate_planned_length(r)),
-                             show_pic=False, save_pic_suffix='NI Algorithm {}'.format(len(r)))
-    rest_customers = list(range(1, instance.n_customers + 1))
+    if sink.enabled:
+        sink.send([r], 'NI Algorithm {}'.format(len(r)), 'NI Algorithm {}'.format(len(r)),
+                  with_expected_cost=False)
+    next_node = {0: farthest_customer, farthest_customer: 0}  # 边的起点 -> 终点，终点的depot不作为起点
+    rest_customers = set(range(1, instance.n_customers + 1))
     rest_customers.remove(farthest_customer)
+
+    def scan(customer):
+        # 按路线顺序一次性计算所有边的增加量，取第一个最小值（np.round与round一样四舍六入五成双）
+        tour = np.array(r)
+        deltas = np.round((instance.distance_matrix[tour[:-1], customer] + instance.distance_matrix[customer, tour[1:]] -
+                           instance.distance_matrix[tour[:-1], tour[1:]]) * 100)
+        i = int(deltas.argmin())
+        return int(deltas[i]), r[i]
+
+    best_insertion = {customer: scan(customer) for customer in rest_customers}
+    version = {customer: 0 for customer in rest_customers}
+    insertion_heap = [(best_insertion[customer][0], customer, 0) for customer in rest_customers]
+    heapq.heapify(insertion_heap)
     while rest_customers:
-        new_lengths = []
-        new_lengths_insertion = []
-        for customer in rest_customers:
-            all_possible_insertion = []
-            for i in range(1, len(r)):
-                new_r = r.copy()
-                new_r.insert(i, customer)
-                all_possible_insertion.append(instance.calculate_planned_length(new_r))
-            new_lengths.append(min(all_possible_insertion))
-            new_lengths_insertion.append(all_possible_insertion.index(min(all_possible_insertion)) + 1)
-        best_customer = rest_customers[new_lengths.index(min(new_lengths))]
-        best_insertion_position = new_lengths_insertion[new_lengths.index(min(new_lengths))]
-        r.insert(best_insertion_position, best_customer)
+        _, best_customer, customer_version = heapq.heappop(insertion_heap)
+        if best_customer not in rest_customers or customer_version != version[best_customer]:
+            continue
+        a = best_insertion.pop(best_customer)[1]
+        b = next_node[a]
+        position_a = r.index(a) if a != 0 else 0
+        r.insert(position_a + 1, best_customer)
+        next_node[a] = best_customer
+        next_node[best_customer] = b
         rest_customers.remove(best_customer)
-        if save_pic:
-            instance.draw_routes([r], description='NI Algorithm {}\nPlanned Cost: {}'.format(
-                len(r), instance.calculate_planned_length(r)),
-                                 show_pic=False, save_pic_suffix='NI Algorithm {}'.format(len(r)))
+        customers = list(rest_customers)
+        # 插入两条新边的增加量对所有客户一次算出
+        new_edge_deltas = [get_insertion_deltas(instance.distance_matrix, customers, a, best_customer),
+                           get_insertion_deltas(instance.distance_matrix, customers, best_customer, b)]
+        for customer, delta_a, delta_best_customer in zip(customers, *new_edge_deltas):
+            old_delta, old_a = best_insertion[customer]
+            if old_a == a:
+                new_delta, new_a = scan(customer)
+            else:
+                new_delta, new_a = old_delta, old_a
+                for edge_a, delta in [(a, delta_a), (best_customer, delta_best_customer)]:
+                    if delta < new_delta:
+                        new_delta, new_a = delta, edge_a
+                    elif delta == new_delta and new_a != a and new_a != best_customer and \
+                            r.index(edge_a) < (r.index(new_a) if new_a != 0 else 0):
+                        new_delta, new_a = delta, edge_a
+            if (new_delta, new_a) != (old_delta, old_a):
+                best_insertion[customer] = (new_delta, new_a)
+                if new_delta != old_delta:
+                    version[customer] += 1
+                    heapq.heappush(insertion_heap, (new_delta, customer, version[customer]))
+        if sink.enabled:
+            sink.send([r], 'NI Algorithm {}'.format(len(r)), 'NI Algorithm {}'.format(len(r)),
+                      with_expected_cost=False)
     return r
 
 
@@ -110,3 +236,18 @@ if __name__ == '__main__':
                             mcvrpsd.calculate_routes_planned_length(R_ni_split),
                             mcvrpsd.calculate_routes_total_expected_length(R_ni_split)),
                         show_pic=False, save_pic_suffix='NI Algorithm S-Split')
+
+    # 检验s_split_with_costs给出的成本与逐条计算的结果一致，包括某个客户的往返就超过L、无法切分的实例
+    import random
+    for check_seed in range(5):
+        for check_cv in [0.1, 0.3]:
+            check_instance = MCVRPSDInstance(n_customers=10, cv=check_cv, random_seed=check_seed)
+            check_random = random.Random(check_seed)
+            for check_L in [check_instance.L, min(check_instance.distance_matrix[0, 1:]) * 1.5]:
+                check_instance.L = check_L
+                for _ in range(5):
+                    check_r = [0] + check_random.sample(range(1, 11), 10) + [0]
+                    check_R, check_costs = s_split_with_costs(check_instance, check_r)
+                    assert check_R == s_split(check_instance, check_r)
+                    assert check_costs == [check_instance.calculate_total_expected_length(route) for route in check_R]
+    print('s_split_with_costs matches calculate_total_expected_length')
@@ -1,9 +1,46 @@
 import time
+import numpy as np
 from section_4_SCW_heuristic import MCVRPSDInstance, SCW
-from section_5_look_ahead_heuristic import s_split, NN, NI
+from section_5_look_ahead_heuristic import s_split, s_split_with_costs, NN, NI
+from progress_sinks import get_sink, BackgroundRendererSink
+from instrumentation import get_profiler, profiled
+from solution import Solution
 
 
-def stochastic_2_opt(instance: MCVRPSDInstance, R: list, result_from='SCW'):
+def iterate_improving_2_opt_moves(instance: MCVRPSDInstance, r: list, neighbor_lists=None, neighbor_positions=None):
+    """
+    按(i, j)从小到大的顺序给出所有能降低计划长度的2-opt交换，即反转r[i:j]。
+
+    反转只把边(r[i - 1], r[i])和(r[j - 1], r[j])换成(r[i - 1], r[j - 1])和(r[i], r[j])，中间各边的长度不变，
+    因此每个交换的计划长度变化可以在常数时间内求出，不需要构造新的路径。距离保留两位小数，变化量也按两位小数比较。
+    路径中各点之间的距离先一次取出为按位置索引的列表，循环中不再逐个读取距离矩阵。
+
+    :param instance: 实例
+    :param r: 路径
+    :param neighbor_lists: 近邻表，给定时只考虑新边(r[i - 1], r[j - 1])或(r[i], r[j])的一端在另一端近邻表中的交换
+    :param neighbor_positions: r中每个点的近邻在r中的位置（-1表示不在r中），None时按neighbor_lists由r求出
+    :return: 生成器，给出(i, j)
+    """
+    distances = instance.distance_matrix[np.ix_(r, r)].tolist()  # distances[i][j]为r[i]到r[j]的距离
+    if neighbor_lists is not None and neighbor_positions is None:
+        position = {node: k for k, node in enumerate(r)}  # depot取最后一位
+        neighbor_positions = [[position.get(c, -1) for c in neighbor_lists[node]] for node in r]
+    for i in range(1, len(r) - 2):
+        if neighbor_lists is None:
+            candidates = range(i + 2, len(r))
+        else:
+            candidates = sorted({p + 1 for p in neighbor_positions[i - 1] if p >= 0} |
+                                {p for p in neighbor_positions[i] if p >= 0})
+            candidates = [j for j in candidates if i + 2 <= j < len(r)]
+        for j in candidates:
+            if round(distances[i - 1][j - 1] + distances[i][j] - distances[i - 1][i] - distances[j - 1][j], 2) < 0:
+                yield i, j
+
+
+@profiled('S2-Opt')
+def stochastic_2_opt(instance: MCVRPSDInstance, R: list, result_from='SCW', neighbors_k=None,
+                     max_iterations=None, time_limit=None, max_no_improvement=None, save_pic=True, verbose=True, sink=None,
+                     pair_filter=None):
     """
     At every iteration, routes r and r0 from the MC-VRPSD solution (R) are merged into a single
     tour, and all possible arc exchanges in the resulting route are explored. To avoid excessive computations,
@@ -17,46 +54,100 @@ def stochastic_2_opt(instance: MCVRPSDInstance, R: list, result_from='SCW'):
     In such case, we deem the move successful, and the MC-VRPSD solution is updated. Finally,
     the procedure is restarted from the top following a first improvement configuration. The S2-Opt procedure
     repeats until it cannot find any more improvements.
+
+    重新开始时，已经确认无法改进的路线对（两条路线都没有变化）直接跳过，因此接受的交换序列与每次都从头扫描的结果相同。
+    路线集保存在Solution中：路线的期望成本只在s_split时计算一次，接受交换时只更新变化的路线，总期望成本随之更新。
+    使用近邻表时，近邻在两条路线拼接后的位置由Solution中客户 -> (路线编号, 位置)的索引一次求出。
+
     :param instance: 实例
     :param R: 路线集
     :param result_from: 路线集是由哪一个方法得到的
+    :param neighbors_k: 近邻表的大小，None表示考虑所有的交换
+    :param max_iterations: 最多接受的交换次数，None表示不限制
+    :param time_limit: 运行时间上限（秒），None表示不限制
+    :param max_no_improvement: 最多连续多少个路线对没有改进，None表示不限制
+    :param save_pic: 每次改进后是否保存图片
+    :param verbose: 每次改进后是否打印总期望成本
+    :param sink: 接收求解过程快照的对象，见progress_sinks，给定时忽略save_pic
+    :param pair_filter: 函数(r, r_apo) -> bool，给定时只尝试返回True的路线对，如decomposition中只修复相邻簇之间的路线
     :return: 优化后的路线集
     """
-    for r in R:
-        for r_apo in R:
-            if r == r_apo:
-                continue
-            r_apo_2 = r[:-1] + r_apo[1:]
-            for i in range(1, len(r_apo_2) - 2):
-                for j in range(i + 2, len(r_apo_2)):
+    sink = get_sink(instance, save_pic, sink)
+    profiler = get_profiler(instance)
+    neighbor_lists = instance.get_neighbor_lists(neighbors_k) if neighbors_k is not None else None
+    # 每个点的近邻数量都是min(k, n)，可以组成二维数组
+    neighbor_array = np.array(neighbor_lists, dtype=int) if neighbor_lists is not None else None
+    solution = Solution(instance, R)
+    profiler.trace('S2-Opt', solution.total_expected_length)
+    start_time = time.time()
+    n_iterations = 0
+    n_no_improvement = 0
+    checked_pairs = set()  # 已确认没有改进的(r, r_apo)，按路线的内容记录
+    try:
+        improved = True
+        while improved:
+            improved = False
+            for route_id, route_apo_id in [(route_id, route_apo_id) for route_id in solution
+                                           for route_apo_id in solution if route_id != route_apo_id]:
+                # 没有可尝试交换的路线对也要检查时间，否则大量这样的路线对可以使运行时间远超上限
+                if time_limit is not None and time.time() - start_time > time_limit:
+                    return R
+                r, r_apo = solution.get_route(route_id), solution.get_route(route_apo_id)
+                if pair_filter is not None and not pair_filter(r, r_apo):
+                    continue
+                pair = (solution.route_keys[route_id], solution.route_keys[route_apo_id])
+                if pair in checked_pairs:
+                    continue
+                if max_no_improvement is not None and n_no_improvement >= max_no_improvement:
+                    return R
+                original_cost = round(solution.expected_cost[route_id] + solution.expected_cost[route_apo_id], 3)
+                r_apo_2 = r[:-1] + r_apo[1:]
+                neighbor_positions = None
+                if neighbor_array is not None:
+                    neighbor_positions = solution.get_merged_positions(route_id, route_apo_id,
+                                                                       neighbor_array[r_apo_2]).tolist()
+                profiler.count('S2-Opt.pairs')
+                for i, j in iterate_improving_2_opt_moves(instance, r_apo_2, neighbor_lists, neighbor_positions):
+                    if time_limit is not None and time.time() - start_time > time_limit:
+                        return R
                     r_apo_3 = r_apo_2[:i] + list(reversed(r_apo_2[i:j])) + r_apo_2[j:]
-                    # 这里是可以优化的，只需要计算变化的边之差就好，但目前的本身也不算麻烦
-                    if instance.calculate_planned_length(r_apo_3) < instance.calculate_planned_length(r_apo_2):
-                        R_apo_3 = s_split(instance, r_apo_3)
-                        if instance.calculate_routes_total_expected_length(
-                                R_apo_3) < instance.calculate_total_expected_length(
-                            r) + instance.calculate_total_expected_length(r_apo):
-                            R.remove(r)
-                            R.remove(r_apo)
-                            R.extend(R_apo_3)
-                            print(mcvrpsd.calculate_routes_total_expected_length(R))
+                    R_apo_3, R_apo_3_costs = s_split_with_costs(instance, r_apo_3)
+                    profiler.count('S2-Opt.moves_evaluated')
+                    if round(sum(R_apo_3_costs), 3) < original_cost:
+                        solution.replace_routes([route_id, route_apo_id], R_apo_3, R_apo_3_costs)
+                        if verbose:
+                            print(solution.total_expected_length)
+                        profiler.count('S2-Opt.moves_accepted')
+                        profiler.trace('S2-Opt', solution.total_expected_length)
+                        if sink.enabled:
                             t_label = time.time()
-                            mcvrpsd.draw_routes(R,
-                                                description='2-Opt optimizes results from {}\nTime: {}\n'
-                                                            'Planned Cost: {}\n'
-                                                            'Total Expected Cost: {}'.format(result_from, t_label,
-                                                         mcvrpsd.calculate_routes_planned_length(R),
-                                                         mcvrpsd.calculate_routes_total_expected_length(R)),
-                                                save_pic_suffix='2-opt-{}-{}'.format(result_from, t_label))
-                            R = stochastic_2_opt(instance, R)
-                            return R
-    return R
+                            sink.send(solution.get_routes(),
+                                      '2-Opt optimizes results from {}\nTime: {}'.format(result_from, t_label),
+                                      '2-opt-{}-{}'.format(result_from, t_label))
+                        improved = True
+                        break
+                if improved:
+                    n_iterations += 1
+                    n_no_improvement = 0
+                    routes = set(solution.route_keys.values())
+                    checked_pairs = {pair for pair in checked_pairs if pair[0] in routes and pair[1] in routes}
+                    if max_iterations is not None and n_iterations >= max_iterations:
+                        return R
+                    break
+                checked_pairs.add(pair)
+                n_no_improvement += 1
+        return R
+    finally:
+        # 与原先一样，结果写回传入的列表
+        R[:] = solution.get_routes()
 
 
 if __name__ == '__main__':
     mcvrpsd = MCVRPSDInstance(n_customers=20, random_seed=0)
+    # 改进过程中的图片在后台进程中绘制，不阻塞搜索
+    renderer = BackgroundRendererSink(mcvrpsd)
     init_R = SCW(mcvrpsd)
-    optimized_R = stochastic_2_opt(instance=mcvrpsd, R=init_R.copy(), result_from='SCW')
+    optimized_R = stochastic_2_opt(instance=mcvrpsd, R=init_R.copy(), result_from='SCW', sink=renderer)
     mcvrpsd.draw_routes(optimized_R,
                         description='2-Opt optimizes results from SCW\nPlanned Cost: {}\nTotal Expected Cost: {}'.format(
                             mcvrpsd.calculate_routes_planned_length(optimized_R),
@@ -64,7 +155,7 @@ if __name__ == '__main__':
                         save_pic_suffix='SCW-2-opt')
     r_nn = NN(mcvrpsd, save_pic=False)
     init_R = s_split(mcvrpsd, r_nn)
-    optimized_R = stochastic_2_opt(instance=mcvrpsd, R=init_R.copy(), result_from='NN')
+    optimized_R = stochastic_2_opt(instance=mcvrpsd, R=init_R.copy(), result_from='NN', sink=renderer)
     mcvrpsd.draw_routes(optimized_R,
                         description='2-Opt optimizes results from NN\nPlanned Cost: {}\nTotal Expected Cost: {}'.format(
                             mcvrpsd.calculate_routes_planned_length(optimized_R),
@@ -73,9 +164,10 @@ if __name__ == '__main__':
 
     r_ni = NI(mcvrpsd, save_pic=False)
     init_R = s_split(mcvrpsd, r_ni)
-    optimized_R = stochastic_2_opt(instance=mcvrpsd, R=init_R.copy(), result_from='NI')
+    optimized_R = stochastic_2_opt(instance=mcvrpsd, R=init_R.copy(), result_from='NI', sink=renderer)
     mcvrpsd.draw_routes(optimized_R,
                         description='2-Opt optimizes results from NI\nPlanned Cost: {}\nTotal Expected Cost: {}'.format(
                             mcvrpsd.calculate_routes_planned_length(optimized_R),
                             mcvrpsd.calculate_routes_total_expected_length(optimized_R)),
                         save_pic_suffix='NI-2-opt')
+    renderer.close()
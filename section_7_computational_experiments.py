@@ -0,0 +1,181 @@
+import os
+import csv
+import json
+import time
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from section_2_3_problem import MCVRPSDInstance
+from section_4_SCW_heuristic import SCW
+from section_5_look_ahead_heuristic import s_split, NN, NI
+from section_6_stochastic_2_opt import stochastic_2_opt
+
+PIPELINES = ['SCW', 'NN', 'NI', 'SCW-2-opt', 'NN-2-opt', 'NI-2-opt']
+EXPERIMENT_KEYS = ['n_customers', 'cv', 'random_seed', 'product_mean_distribution', 'pipeline']
+RECORD_FIELDS = EXPERIMENT_KEYS + ['planned_cost', 'total_expected_cost', 'n_routes', 'wall_time', 'error']
+
+
+def run_pipeline(instance: MCVRPSDInstance, pipeline, **s2opt_kwargs):
+    """
+    在实例上运行一种启发式流程，不保存图片。
+
+    :param instance: 案例
+    :param pipeline: PIPELINES中的一种，如'SCW'、'NN-2-opt'
+    :param s2opt_kwargs: 传给stochastic_2_opt的其他参数，如neighbors_k、time_limit
+    :return: 路线集
+    """
+    construction = pipeline.split('-')[0]
+    if construction == 'SCW':
+        R = SCW(instance, save_pic=False)
+    elif construction == 'NN':
+        R = s_split(instance, NN(instance, save_pic=False))
+    elif construction == 'NI':
+        R = s_split(instance, NI(instance, save_pic=False))
+    else:
+        raise ValueError('Unknown pipeline: {}'.format(pipeline))
+    if pipeline.endswith('-2-opt'):
+        R = stochastic_2_opt(instance, R, result_from=construction, save_pic=False, verbose=False, **s2opt_kwargs)
+    return R
+
+
+def run_experiment(experiment):
+    """
+    生成实例并运行一次实验，供进程池调用。
+
+    :param experiment: 包含EXPERIMENT_KEYS的字典
+    :return: 一条结果记录
+    """
+    record = dict(experiment)
+    start_time = time.time()
+    try:
+        instance = MCVRPSDInstance(n_customers=experiment['n_customers'], cv=experiment['cv'],
+                                   product_mean_distribution=experiment['product_mean_distribution'],
+                                   random_seed=experiment['random_seed'])
+        R = run_pipeline(instance, experiment['pipeline'])
+        record.update(planned_cost=instance.calculate_routes_planned_length(R),
+                      total_expected_cost=instance.calculate_routes_total_expected_length(R),
+                      n_routes=len(R), error='')
+    except Exception as e:
+        record.update(planned_cost='', total_expected_cost='', n_routes='', error=repr(e))
+    record['wall_time'] = round(time.time() - start_time, 3)
+    return record
+
+
+def get_experiments(n_customers_list, cv_list, random_seeds, pipelines, product_mean_distribution='uniform'):
+    """
+    实例参数与启发式流程的网格。
+
+    :return: 实验列表，每项为包含EXPERIMENT_KEYS的字典
+    """
+    return [{'n_customers': n_customers, 'cv': cv, 'random_seed': random_seed,
+             'product_mean_distribution': product_mean_distribution, 'pipeline': pipeline}
+            for n_customers, cv, random_seed, pipeline in itertools.product(n_customers_list, cv_list,
+                                                                           random_seeds, pipelines)]
+
+
+def get_experiment_key(record):
+    return tuple(str(record[key]) for key in EXPERIMENT_KEYS)
+
+
+def read_finished_experiments(result_path):
+    """
+    读取已经完成（没有出错）的实验，用于中断后继续。写到一半的最后一行会被忽略。
+
+    :param result_path: 结果文件，.jsonl或.csv
+    :return: 已完成实验的键的集合
+    """
+    finished = set()
+    if not os.path.exists(result_path):
+        return finished
+    with open(result_path, newline='') as f:
+        if result_path.endswith('.csv'):
+            records = [record for record in csv.DictReader(f) if None not in record.values()]
+        else:
+            records = []
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    for record in records:
+        if not record.get('error') and all(key in record for key in EXPERIMENT_KEYS):
+            finished.add(get_experiment_key(record))
+    return finished
+
+
+def truncate_partial_last_line(result_path, chunk_size=65536):
+    """
+    删除结果文件末尾写到一半（没有换行符结尾）的一行，避免继续追加时新记录接在这一行后面而无法读取。
+
+    :param result_path: 结果文件
+    :param chunk_size: 从文件末尾向前查找换行符时每次读取的字节数
+    :return: 无
+    """
+    if not os.path.exists(result_path):
+        return
+    with open(result_path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        if end == 0:
+            return
+        f.seek(end - 1)
+        if f.read(1) == b'\n':
+            return
+        position = end
+        while position > 0:
+            start = max(position - chunk_size, 0)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b'\n')
+            if newline >= 0:
+                f.truncate(start + newline + 1)
+                return
+            position = start
+        f.truncate(0)
+
+
+def run_experiments(experiments, result_path, n_workers=None):
+    """
+    用进程池并行运行实验，每完成一个就把结果追加写入结果文件。已经在结果文件中成功完成的实验会被跳过，因此中断后可以直接重新运行。
+
+    :param experiments: 实验列表，见get_experiments
+    :param result_path: 结果文件，.csv或.jsonl（其他扩展名按jsonl写入）
+    :param n_workers: 进程数，None为CPU核数
+    :return: 本次运行得到的结果记录
+    """
+    finished = read_finished_experiments(result_path)
+    experiments = [experiment for experiment in experiments if get_experiment_key(experiment) not in finished]
+    result_dir = os.path.dirname(result_path)
+    if result_dir and not os.path.exists(result_dir):
+        os.makedirs(result_dir)
+    truncate_partial_last_line(result_path)
+    is_csv = result_path.endswith('.csv')
+    write_header = is_csv and (not os.path.exists(result_path) or os.path.getsize(result_path) == 0)
+    records = []
+    with open(result_path, 'a', newline='') as f, ProcessPoolExecutor(max_workers=n_workers) as executor:
+        writer = csv.DictWriter(f, fieldnames=RECORD_FIELDS) if is_csv else None
+        if write_header:
+            writer.writeheader()
+        futures = [executor.submit(run_experiment, experiment) for experiment in experiments]
+        for future in as_completed(futures):
+            record = future.result()
+            if is_csv:
+                writer.writerow(record)
+            else:
+                f.write(json.dumps(record) + '\n')
+            f.flush()
+            records.append(record)
+            print('{}/{} {}'.format(len(records), len(experiments), record))
+    return records
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run MC-VRPSD heuristics over a grid of instances.')
+    parser.add_argument('--customers', type=int, nargs='+', default=[10, 20])
+    parser.add_argument('--cv', type=float, nargs='+', default=[0.1, 0.3])
+    parser.add_argument('--seeds', type=int, default=10, help='random seeds 0, 1, ..., seeds - 1')
+    parser.add_argument('--pipelines', nargs='+', default=PIPELINES, choices=PIPELINES)
+    parser.add_argument('--distribution', default='uniform', choices=['uniform', '01'])
+    parser.add_argument('--output', default='01_Results/experiments.jsonl')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    run_experiments(get_experiments(args.customers, args.cv, range(args.seeds), args.pipelines, args.distribution),
+                    args.output, n_workers=args.workers)
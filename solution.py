@@ -0,0 +1,142 @@
+import numpy as np
+from section_2_3_problem import MCVRPSDInstance
+
+
+class Solution:
+    def __init__(self, instance: MCVRPSDInstance, R=(), expected_costs=None):
+        """
+        路线集的数据结构：每条路线有一个编号，并缓存计划成本和期望成本，总成本随增删路线一起更新，替换时只计算新的路线。
+        路线按加入的先后顺序排列，与原先对列表R先remove再append的顺序一致。每条路线保存整数数组（计算计划成本）、列表
+        （用于拼接路线）和tuple（S2-Opt中按内容记录已检查的路线对）三种形式；客户 -> (路线编号, 位置)的索引也只更新变化的路线，
+        S2-Opt由它直接得到近邻在两条路线拼接后的位置。
+
+        路线的成本都保留了小数位（期望成本两位，计划成本三位），总成本按整数累计，没有浮点误差的积累，
+        与calculate_routes_total_expected_length、calculate_routes_planned_length的结果相同。
+
+        :param instance: 案例
+        :param R: 初始的路线集
+        :param expected_costs: 初始路线的期望成本，None时批量计算
+        """
+        self.instance = instance
+        self.routes = {}  # 路线编号 -> 路线数组
+        self.route_lists = {}  # 路线编号 -> 路线的列表形式
+        self.route_keys = {}  # 路线编号 -> 路线的tuple，用于按内容比较
+        self.expected_cost = {}
+        self.planned_cost = {}
+        self.customer_route = np.full(instance.n_customers + 1, -1, dtype=int)
+        self.customer_position = np.full(instance.n_customers + 1, -1, dtype=int)
+        self.next_route_id = 0
+        self.expected_hundredths = 0
+        self.planned_thousandths = 0
+        self.add_routes(R, expected_costs)
+
+    def __len__(self):
+        return len(self.routes)
+
+    def __contains__(self, route_id):
+        return route_id in self.routes
+
+    def __iter__(self):
+        return iter(list(self.routes))
+
+    @property
+    def total_expected_length(self):
+        return round(self.expected_hundredths / 100, 3)
+
+    @property
+    def total_planned_length(self):
+        return round(self.planned_thousandths / 1000, 2)
+
+    def get_route(self, route_id):
+        return self.route_lists[route_id]
+
+    def get_routes(self):
+        """
+        :return: 路线集，list of list
+        """
+        return [list(r) for r in self.route_lists.values()]
+
+    def get_customer_route(self, customer):
+        """
+        :param customer: 客户编号
+        :return: (路线编号, 在路线中的位置)，客户不在任何路线中时为(-1, -1)
+        """
+        return int(self.customer_route[customer]), int(self.customer_position[customer])
+
+    def get_merged_positions(self, route_id, route_apo_id, nodes):
+        """
+        点在两条路线首尾相接得到的巨型路线r[:-1] + r_apo[1:]中的位置，由客户的索引直接得到，不需要扫描路线。
+
+        :param route_id: 路线r的编号
+        :param route_apo_id: 路线r_apo的编号
+        :param nodes: 点的编号，任意形状的整数数组
+        :return: 与nodes形状相同的数组，depot取最后一位，不在这两条路线中的点为-1
+        """
+        nodes = np.asarray(nodes, dtype=int)
+        offset = len(self.route_lists[route_id]) - 2
+        route = self.customer_route[nodes]
+        position = self.customer_position[nodes]
+        merged_position = np.where(route == route_id, position, np.where(route == route_apo_id, position + offset, -1))
+        return np.where(nodes == 0, offset + len(self.route_lists[route_apo_id]) - 1, merged_position)
+
+    def add_routes(self, R, expected_costs=None):
+        """
+        加入若干条路线。
+
+        :param R: 路线的列表
+        :param expected_costs: 这些路线的期望成本，None时批量计算
+        :return: 新路线的编号
+        """
+        R = [list(r) for r in R]
+        if not R:
+            return []
+        if expected_costs is None:
+            expected_costs = self.instance.calculate_batch_total_expected_length(R)
+        route_ids = []
+        for r, expected_cost in zip(R, expected_costs):
+            route_id = self.next_route_id
+            self.next_route_id += 1
+            route = np.array(r, dtype=int)
+            planned_cost = self.instance.calculate_planned_length(route)
+            self.routes[route_id] = route
+            self.route_lists[route_id] = r
+            self.route_keys[route_id] = tuple(r)
+            self.expected_cost[route_id] = expected_cost
+            self.planned_cost[route_id] = planned_cost
+            self.expected_hundredths += round(expected_cost * 100)
+            self.planned_thousandths += round(planned_cost * 1000)
+            positions = np.flatnonzero(route[1:-1]) + 1
+            self.customer_route[route[positions]] = route_id
+            self.customer_position[route[positions]] = positions
+            route_ids.append(route_id)
+        return route_ids
+
+    def remove_route(self, route_id):
+        """
+        删除一条路线。
+
+        :param route_id: 路线编号
+        :return: 路线的列表形式
+        """
+        route = self.routes.pop(route_id)
+        self.route_keys.pop(route_id)
+        self.expected_hundredths -= round(self.expected_cost.pop(route_id) * 100)
+        self.planned_thousandths -= round(self.planned_cost.pop(route_id) * 1000)
+        customers = route[1:-1]
+        customers = customers[customers != 0]
+        self.customer_route[customers] = -1
+        self.customer_position[customers] = -1
+        return self.route_lists.pop(route_id)
+
+    def replace_routes(self, route_ids, R, expected_costs=None):
+        """
+        用新的路线替换若干条路线，如SCW中的合并和S2-Opt中s_split得到的路线。
+
+        :param route_ids: 被替换的路线编号
+        :param R: 新的路线
+        :param expected_costs: 新路线的期望成本，None时批量计算
+        :return: 新路线的编号
+        """
+        for route_id in route_ids:
+            self.remove_route(route_id)
+        return self.add_routes(R, expected_costs)
@@ -0,0 +1,139 @@
+import math
+import numpy as np
+
+
+class UniformGridIndex:
+    def __init__(self, positions, distances, nodes=None, cell_size=None):
+        """
+        均匀网格空间索引，支持删除点以及k近邻、半径查询。
+
+        查询结果中的距离取自distances（即案例中保留两位小数的距离），按(距离, 编号)排序，与启发式中逐个比较距离、
+        编号小者优先的结果一致。网格只用来排除不可能的点：第k圈格子中的点与查询点的实际距离至少为(k - 1)个格子的边长。
+
+        :param positions: 所有点的坐标，n x 2 的数组
+        :param distances: 距离矩阵，n x n 的数组（可以是内存映射的数组），每次查询只读取查询点所在的一行
+        :param nodes: 放入索引的点，None表示所有点
+        :param cell_size: 格子的边长，None时按平均每个格子约两个点确定
+        """
+        self.positions = np.asarray(positions)
+        self.distances = np.asarray(distances)
+        self.nodes = set(range(len(self.positions))) if nodes is None else set(nodes)
+        self.origin = self.positions.min(axis=0) if len(self.positions) else np.zeros(2)
+        self.extent = self.positions.max(axis=0) - self.origin if len(self.positions) else np.zeros(2)
+        self.cell_size = cell_size
+        self.cells = {}
+        self.n_cells = (0, 0)
+        self.build(cell_size)
+
+    def build(self, cell_size=None):
+        """
+        按当前的点重新划分网格。
+
+        :param cell_size: 格子的边长，None时按平均每个格子约两个点确定
+        :return: 无
+        """
+        if cell_size is None:
+            n_nodes = max(len(self.nodes), 1)
+            width = max(float(self.extent.max()), 1e-9)
+            # 点共线（某一方向的范围为0）时面积为0，按宽度为width / n_nodes的长条计算，每个格子仍约两个点
+            area = max(float(self.extent[0]) * float(self.extent[1]), width * width / n_nodes)
+            cell_size = math.sqrt(2 * area / n_nodes)
+            # 两个方向上格子数量的乘积不超过点数的两倍左右，避免扫描大量的空格子
+            while (self.extent[0] // cell_size + 1) * (self.extent[1] // cell_size + 1) > 2 * n_nodes + 1:
+                cell_size *= 1.5
+        self.cell_size = cell_size
+        self.n_cells = (int(self.extent[0] // cell_size) + 1, int(self.extent[1] // cell_size) + 1)
+        self.cells = {}
+        for node in self.nodes:
+            self.cells.setdefault(self.get_cell(node), set()).add(node)
+
+    def get_cell(self, node):
+        x, y = (self.positions[node] - self.origin) // self.cell_size
+        return min(int(x), self.n_cells[0] - 1), min(int(y), self.n_cells[1] - 1)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node):
+        return node in self.nodes
+
+    def remove(self, node):
+        """
+        删除一个点。点的数量远少于格子数量时改用更大的格子，避免查询时扫描大量的空格子。
+
+        :param node: 点的编号
+        :return: 无
+        """
+        self.nodes.remove(node)
+        cell = self.get_cell(node)
+        self.cells[cell].remove(node)
+        if not self.cells[cell]:
+            del self.cells[cell]
+        if self.nodes and len(self.nodes) * 8 < self.n_cells[0] * self.n_cells[1]:
+            self.build()
+
+    def iterate_rings(self, node):
+        """
+        从查询点所在的格子开始，一圈一圈向外给出格子中的点。
+
+        :param node: 查询点
+        :return: 生成器，给出(圈数, 这一圈中的点)
+        """
+        cx, cy = self.get_cell(node)
+        max_ring = max(cx, cy, self.n_cells[0] - 1 - cx, self.n_cells[1] - 1 - cy)
+        for ring in range(max_ring + 1):
+            ring_nodes = []
+            for x in range(max(cx - ring, 0), min(cx + ring, self.n_cells[0] - 1) + 1):
+                if abs(x - cx) == ring:
+                    ys = range(max(cy - ring, 0), min(cy + ring, self.n_cells[1] - 1) + 1)
+                else:
+                    ys = [y for y in [cy - ring, cy + ring] if 0 <= y < self.n_cells[1]]
+                for y in ys:
+                    ring_nodes.extend(self.cells.get((x, y), ()))
+            yield ring, ring_nodes
+
+    def nearest(self, node, k=1, exclude_self=True):
+        """
+        k近邻查询。
+
+        :param node: 查询点（不要求在索引中）
+        :param k: 近邻数量
+        :param exclude_self: 结果中是否排除查询点自己
+        :return: 最近的k个点，按(距离, 编号)排序
+        """
+        distances = self.distances[node]
+        candidates = []
+        n_seen = 0
+        for ring, ring_nodes in self.iterate_rings(node):
+            n_seen += len(ring_nodes)
+            candidates.extend((distance, other) for distance, other in zip(distances[ring_nodes].tolist(), ring_nodes)
+                              if not (exclude_self and other == node))
+            if len(candidates) >= k:
+                candidates.sort()
+                del candidates[k:]
+                # 尚未扫描的点与查询点的距离至少为ring个格子的边长，距离取整最多带来0.005的误差
+                if candidates[-1][0] < ring * self.cell_size - 0.005:
+                    break
+            if n_seen >= len(self.nodes):
+                break
+        candidates.sort()
+        return [other for _, other in candidates[:k]]
+
+    def within(self, node, radius, exclude_self=True):
+        """
+        半径查询。
+
+        :param node: 查询点
+        :param radius: 半径（包含边界）
+        :param exclude_self: 结果中是否排除查询点自己
+        :return: 距离不超过radius的点，按(距离, 编号)排序
+        """
+        distances = self.distances[node]
+        result = []
+        for ring, ring_nodes in self.iterate_rings(node):
+            if (ring - 1) * self.cell_size - 0.005 > radius:
+                break
+            result.extend((distance, other) for distance, other in zip(distances[ring_nodes].tolist(), ring_nodes)
+                          if distance <= radius and not (exclude_self and other == node))
+        result.sort()
+        return [other for _, other in result]